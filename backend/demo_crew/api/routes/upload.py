@@ -16,6 +16,7 @@ if parent_dir not in sys.path:
     sys.path.insert(0, parent_dir)
 
 from demo_crew.master_agent import MasterAgent
+from demo_crew.tools.langchain_utils import json_dumps, release_loop_resources
 from demo_crew.langsmith_integration import setup_langsmith
 
 # Create router
@@ -88,8 +89,8 @@ async def process_file(file_path: str, file_type: str, instructions: Optional[st
         processed_dir = os.path.join(os.path.dirname(os.path.dirname(file_path)), "processed")
         result_path = os.path.join(processed_dir, result_filename)
         
-        with open(result_path, "w") as f:
-            json.dump(result, f, indent=2)
+        with open(result_path, "wb") as f:
+            f.write(json_dumps(result, indent=True))
         
         # Create simplified dataset
         backend_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
@@ -106,8 +107,8 @@ async def process_file(file_path: str, file_type: str, instructions: Optional[st
         }
         
         # Save the dataset
-        with open(combined_dataset_path, "w") as f:
-            json.dump(new_dataset, f, indent=2)
+        with open(combined_dataset_path, "wb") as f:
+            f.write(json_dumps(new_dataset, indent=True))
         
         # Copy to the demo_crew directory
         demo_crew_dir = os.path.join(backend_dir, "demo_crew")
@@ -116,8 +117,8 @@ async def process_file(file_path: str, file_type: str, instructions: Optional[st
         # Ensure demo_crew directory exists
         os.makedirs(os.path.dirname(demo_crew_output_path), exist_ok=True)
         
-        with open(demo_crew_output_path, "w") as f:
-            json.dump(new_dataset, f, indent=2)
+        with open(demo_crew_output_path, "wb") as f:
+            f.write(json_dumps(new_dataset, indent=True))
         
         return result_path
     
@@ -143,8 +144,8 @@ async def process_file(file_path: str, file_type: str, instructions: Optional[st
         processed_dir = os.path.join(os.path.dirname(os.path.dirname(file_path)), "processed")
         result_path = os.path.join(processed_dir, result_filename)
         
-        with open(result_path, "w") as f:
-            json.dump(result, f, indent=2)
+        with open(result_path, "wb") as f:
+            f.write(json_dumps(result, indent=True))
         
         return result_path
 
@@ -191,6 +192,8 @@ async def upload_file(
                 import traceback
                 print(traceback.format_exc())
             finally:
+                # Close this loop's shared HTTP pool before the loop goes away
+                loop.run_until_complete(release_loop_resources())
                 loop.close()
         
         # Add the synchronous wrapper to background tasks
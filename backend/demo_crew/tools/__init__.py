@@ -3,12 +3,24 @@ Tools module for processing different types of files.
 This module gracefully handles missing dependencies.
 """
 from typing import Dict, Any, Optional
+import atexit
 import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Hand log records to a background thread so handler I/O never blocks the event loop
+_root_logger = logging.getLogger()
+if not any(isinstance(h, QueueHandler) for h in _root_logger.handlers):
+    _log_queue = queue.SimpleQueue()
+    _log_listener = QueueListener(_log_queue, *_root_logger.handlers, respect_handler_level=True)
+    _root_logger.handlers = [QueueHandler(_log_queue)]
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
+
 # Initialize empty mapping
 TOOL_MAPPING = {}
 
@@ -5,13 +5,16 @@ import os
 import json
 import asyncio
 import tempfile
-import traceback
-from typing import Dict, Any, Optional, List
+import logging
+import threading
+from typing import Dict, Any, Optional, List, Tuple
 import mimetypes
+from difflib import SequenceMatcher
 
 try:
     import whisper
     import numpy as np
+    import torch
     WHISPER_AVAILABLE = True
 except ImportError:
     # Fallback to basic functionality if dependencies aren't available
@@ -24,6 +27,8 @@ except ImportError:
         def load_model(*args, **kwargs):
             return None
             
+logger = logging.getLogger(__name__)
+
 # We'll use OpenAI's API directly for transcription
 try:
     import openai
@@ -60,11 +65,87 @@ from .langchain_utils import (
     get_llm, 
     create_prompt, 
     run_llm_chain, 
+    json_loads,
     LANGCHAIN_AVAILABLE
 )
 
 from .base_processor import BaseProcessor
 
+# Common audio MIME types, resolved without touching the system mimetypes table
+_AUDIO_MIME = {
+    ".mp3": "audio/mpeg",
+    ".wav": "audio/wav",
+    ".m4a": "audio/mp4",
+    ".flac": "audio/flac",
+    ".ogg": "audio/ogg",
+    ".aac": "audio/aac",
+    ".webm": "audio/webm",
+}
+
+def _guess_mime(ext: str) -> str:
+    """
+    Resolve the MIME type for an audio file extension
+    
+    Args:
+        ext: Lower-cased file extension including the leading dot
+        
+    Returns:
+        MIME type string, defaulting to audio/mpeg
+    """
+    mime = _AUDIO_MIME.get(ext)
+    if mime is None:
+        mime = mimetypes.guess_type("file" + ext)[0] or "audio/mpeg"
+    return mime
+
+# Long local transcriptions are split into overlapping windows that are
+# transcribed a few at a time, each on its own model instance
+_LONG_AUDIO_SECONDS = 600
+_CHUNK_SECONDS = 30
+_CHUNK_OVERLAP_SECONDS = 0.5
+_CHUNK_WINDOW = 2
+_SAMPLE_RATE = 16000
+
+# Chunk models are loaded once per process and shared by all processors.
+# Whisper installs its decoding hooks on the model itself, so each model is
+# paired with a lock that is held for the whole transcribe call.
+_CHUNK_MODELS: List[Tuple[Any, threading.Lock]] = []
+_CHUNK_MODELS_LOCK = threading.Lock()
+
+def _load_chunk_models() -> List[Tuple[Any, threading.Lock]]:
+    """
+    Load the shared Whisper models used for chunked transcription
+    
+    A GPU gets one model per concurrent chunk slot; a CPU gets a single model,
+    since concurrent transcribes would only compete for the same threads.
+    
+    Returns:
+        List of (model, lock) pairs (may be shorter than the window)
+    """
+    with _CHUNK_MODELS_LOCK:
+        window = _CHUNK_WINDOW if torch.cuda.is_available() else 1
+        while len(_CHUNK_MODELS) < window:
+            try:
+                _CHUNK_MODELS.append((whisper.load_model("base"), threading.Lock()))
+            except Exception as e:
+                logger.warning("Failed to initialize chunk Whisper model: %s", e)
+                break
+        return list(_CHUNK_MODELS)
+
+def _transcribe_chunk(slot: Tuple[Any, threading.Lock], audio: Any) -> Dict[str, Any]:
+    """
+    Transcribe one chunk while holding its model's lock
+    
+    Args:
+        slot: (model, lock) pair from _load_chunk_models
+        audio: Chunk samples
+        
+    Returns:
+        Whisper transcribe() result
+    """
+    model, lock = slot
+    with lock:
+        return model.transcribe(audio)
+
 class AudioProcessor(BaseProcessor):
     """Processor for audio files with transcription capabilities"""
     
@@ -99,6 +180,12 @@ Follow these guidelines:
 {instructions}
 """
         
+        # Build the prompt once; only the instructions vary per request
+        self._base_prompt = create_prompt(
+            system_template=self.system_template,
+            human_template="Here is the audio transcript to analyze and extract information from:\n\n{transcript}"
+        )
+        
     @property
     def transcription_model(self):
         """Lazy initialization of transcription model"""
@@ -110,6 +197,53 @@ Follow these guidelines:
                 self._transcription_model = None
         return self._transcription_model
         
+    async def _transcribe_long_audio(self, audio: Any) -> Dict[str, Any]:
+        """
+        Transcribe long audio in overlapping chunks with a small concurrent window
+        
+        Args:
+            audio: Mono 16 kHz float32 samples as returned by whisper.load_audio
+            
+        Returns:
+            Dict shaped like a Whisper transcribe() result with merged segments
+        """
+        # Load off the event loop; fall back to this processor's model if none loaded
+        models = await asyncio.to_thread(_load_chunk_models)
+        if not models:
+            models = [(self.transcription_model, threading.Lock())]
+        chunk_size = _CHUNK_SECONDS * _SAMPLE_RATE
+        stride = int((_CHUNK_SECONDS - _CHUNK_OVERLAP_SECONDS) * _SAMPLE_RATE)
+        starts = list(range(0, len(audio), stride))
+        
+        # Transcribe chunks in windows, pairing each in-flight chunk with its own model
+        chunk_results = []
+        for window_start in range(0, len(starts), len(models)):
+            window = starts[window_start:window_start + len(models)]
+            chunk_results.extend(await asyncio.gather(*[
+                asyncio.to_thread(_transcribe_chunk, slot, audio[start:start + chunk_size])
+                for slot, start in zip(models, window)
+            ]))
+        
+        # Merge segments, shifting timestamps and dropping duplicates from the overlap
+        merged = []
+        for start, result in zip(starts, chunk_results):
+            offset = start / _SAMPLE_RATE
+            for segment in result.get('segments') or []:
+                segment = dict(segment, start=segment.get('start', 0) + offset, end=segment.get('end', 0) + offset)
+                if merged and segment['start'] < merged[-1]['end']:
+                    similarity = SequenceMatcher(None, merged[-1].get('text', ''), segment.get('text', '')).ratio()
+                    if similarity > 0.8:
+                        continue
+                merged.append(segment)
+        
+        for idx, segment in enumerate(merged):
+            segment['id'] = idx
+            
+        return {
+            "text": "".join(segment.get('text', '') for segment in merged),
+            "segments": merged
+        }
+        
     async def _transcribe_audio(self, audio_path: str) -> Dict[str, Any]:
         """
         Transcribe audio file using OpenAI API, Whisper (if available), or fallback to audio analysis
@@ -164,20 +298,18 @@ Follow these guidelines:
                                 # Process the response
                                 if hasattr(response, 'text'):
                                     main_text = response.text
-                                    segments = []
                                     
-                                    # If we have segments, process them
-                                    if hasattr(response, 'segments'):
-                                        for idx, segment in enumerate(response.segments):
-                                            # Fix: Handle segment objects properly based on their actual structure
-                                            segment_data = {
-                                                "id": idx,
-                                                "start": getattr(segment, 'start', 0),
-                                                "end": getattr(segment, 'end', 0),
-                                                "text": getattr(segment, 'text', ''),
-                                                "confidence": getattr(segment, 'confidence', 1.0)
-                                            }
-                                            segments.append(segment_data)
+                                    # If we have segments, process them (segment objects expose attributes)
+                                    segments = [
+                                        {
+                                            "id": idx,
+                                            "start": getattr(segment, 'start', 0),
+                                            "end": getattr(segment, 'end', 0),
+                                            "text": getattr(segment, 'text', ''),
+                                            "confidence": getattr(segment, 'confidence', 1.0)
+                                        }
+                                        for idx, segment in enumerate(getattr(response, 'segments', None) or [])
+                                    ]
                                     
                                     return {
                                         "text": main_text,
@@ -237,19 +369,26 @@ Follow these guidelines:
                 }
                 
             try:
+                # Decode once so long recordings can be chunked
+                audio = await asyncio.to_thread(whisper.load_audio, audio_path)
+                
                 # Run transcription (wrap in asyncio.to_thread for async execution)
-                result = await asyncio.to_thread(self.transcription_model.transcribe, audio_path)
+                if len(audio) > _LONG_AUDIO_SECONDS * _SAMPLE_RATE:
+                    result = await self._transcribe_long_audio(audio)
+                else:
+                    result = await asyncio.to_thread(self.transcription_model.transcribe, audio)
                 
                 # Extract segments with timestamps
-                segments = []
-                for segment in result.get('segments', []):
-                    segments.append({
+                segments = [
+                    {
                         "id": segment.get('id', 0),
                         "start": segment.get('start', 0),
                         "end": segment.get('end', 0),
                         "text": segment.get('text', ''),
                         "confidence": segment.get('confidence', 0)
-                    })
+                    }
+                    for segment in result.get('segments') or []
+                ]
                     
                 return {
                     "text": result.get('text', ''),
@@ -357,16 +496,16 @@ Follow these guidelines:
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"File not found: {file_path}")
         
-        # Get file metadata
-        metadata = self._get_file_metadata(file_path)
-        
         # Custom instructions handling
         instruction_text = ""
         if instructions:
             instruction_text = f"Additional instructions: {instructions}"
             
-        # Transcribe the audio
-        transcription = await self._transcribe_audio(file_path)
+        # Transcribe the audio while gathering file metadata in a worker thread
+        transcription, metadata = await asyncio.gather(
+            self._transcribe_audio(file_path),
+            asyncio.to_thread(self._get_file_metadata, file_path),
+        )
         
         # If transcription completely failed (no text at all), return early
         if not transcription.get('text'):
@@ -376,7 +515,7 @@ Follow these guidelines:
                     "metadata": metadata
                 },
                 "file_type": "audio",
-                "mime_type": mimetypes.guess_type(file_path)[0] or "audio/mpeg"
+                "mime_type": _guess_mime(os.path.splitext(file_path)[1].lower())
             }
             
         # If we have basic detection but no real transcription, provide an informative response
@@ -396,14 +535,11 @@ Follow these guidelines:
                     "metadata": metadata
                 },
                 "file_type": "audio",
-                "mime_type": mimetypes.guess_type(file_path)[0] or "audio/mpeg"
+                "mime_type": _guess_mime(os.path.splitext(file_path)[1].lower())
             }
         
-        # Create a proper prompt using our utility function
-        prompt = create_prompt(
-            system_template=self.system_template.format(instructions=instruction_text),
-            human_template="Here is the audio transcript to analyze and extract information from:\n\n{transcript}"
-        )
+        # Bind the instructions to the prebuilt prompt
+        prompt = self._base_prompt.partial(instructions=instruction_text) if self._base_prompt else None
         
         # Run the LLM chain using our utility function
         result_dict = await run_llm_chain(prompt, self.llm, {"transcript": transcription['text']})
@@ -428,7 +564,7 @@ Follow these guidelines:
                 json_end = analysis.rfind("}") + 1
                 json_str = analysis[json_start:json_end]
                 
-                structured_data = json.loads(json_str)
+                structured_data = json_loads(json_str)
             else:
                 # If not JSON, keep as text
                 structured_data = {"analysis": analysis}
@@ -446,7 +582,7 @@ Follow these guidelines:
         return {
             "audio_processing_result": result,
             "file_type": "audio",
-            "mime_type": mimetypes.guess_type(file_path)[0] or "audio/mpeg"
+            "mime_type": _guess_mime(os.path.splitext(file_path)[1].lower())
         }
         
     async def run_with_tracing(self, file_path: str, instructions: Optional[str] = None) -> Dict[str, Any]:
@@ -473,14 +609,11 @@ Follow these guidelines:
                 "instructions": instructions
             }
         except Exception as e:
-            import traceback
-            error_traceback = traceback.format_exc()
-            print(f"Error in run_with_tracing for AudioProcessor: {str(e)}\n{error_traceback}")
+            logger.exception("AudioProcessor failed for %s", file_path)
             
             return {
                 "status": "error",
-                "error": str(e),
-                "traceback": error_traceback,
+                "error": f"{type(e).__name__}: {e}",
                 "file_path": file_path,
                 "file_type": "audio"
             }
@@ -2,12 +2,16 @@
 Base processor class for all file processing tools.
 """
 import os
+import asyncio
+import logging
 from typing import Dict, Any, Optional
 from abc import ABC, abstractmethod
 from langchain.callbacks.tracers.langchain import wait_for_all_tracers
 from langchain.smith import RunEvalConfig
 import time
 
+logger = logging.getLogger(__name__)
+
 class BaseProcessor(ABC):
     """Base class for all file processors"""
     
@@ -111,15 +115,16 @@ class BaseProcessor(ABC):
                 instructions=instructions
             )
             
-            # Wait for any tracers to finish
-            wait_for_all_tracers()
+            # Wait for any tracers to finish without blocking the event loop
+            await asyncio.to_thread(wait_for_all_tracers)
             
             return formatted_result
         
         except Exception as e:
             # Handle any exceptions during processing
             processing_time = time.time() - start_time
-            error_message = str(e)
+            error_message = f"{type(e).__name__}: {e}"
+            logger.exception("%s failed for %s", self.name, file_path)
             
             return {
                 "status": "failed",
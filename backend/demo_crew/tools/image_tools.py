@@ -2,21 +2,45 @@
 Image processor for handling image files with OCR and analysis capabilities.
 """
 import os
-import json
 import asyncio
-from typing import Dict, Any, Optional, List
+import logging
+from typing import Dict, Any, Optional, List, Tuple
 import mimetypes
 import tempfile
 from io import BytesIO
-import base64
+import mmap
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# pybase64 wraps a SIMD base64 codec with the same API as the stdlib module
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
+
+import numpy as np
 
 try:
-    from PIL import Image
-    import numpy as np
+    from PIL import Image, ImageOps, ImageSequence
+    import paddleocr
     from paddleocr import PaddleOCR
+    # PaddleOCR 3.x replaced the 2.x constructor options, ocr() call and result format
+    PADDLEOCR_V3 = int(paddleocr.__version__.split(".")[0]) >= 3
+    OCR_AVAILABLE = True
 except ImportError:
     # Fallback to basic functionality if dependencies aren't available
-    pass
+    PADDLEOCR_V3 = False
+    OCR_AVAILABLE = False
+
+# Optional on-disk cache for OCR / vision results keyed by file content
+try:
+    import diskcache
+    DISKCACHE_AVAILABLE = True
+except ImportError:
+    DISKCACHE_AVAILABLE = False
 
 # Import the utility module for LangChain compatibility
 from .langchain_utils import (
@@ -24,11 +48,234 @@ from .langchain_utils import (
     create_prompt, 
     run_vision_model, 
     HumanMessage,  # For vision model
+    parse_llm_json,
+    loop_local,
     LANGCHAIN_AVAILABLE
 )
 
 from .base_processor import BaseProcessor
 
+# Vision models downscale to a fixed tile grid, so larger images only add payload
+_MAX_IMAGE_SIDE = 2048
+_MAX_PASSTHROUGH_BYTES = 1024 * 1024
+_JPEG_QUALITY = 85
+# Formats the vision API accepts as-is; anything else is re-encoded
+_VISION_MIME_TYPES = {"image/jpeg", "image/png", "image/gif", "image/webp"}
+
+# Process-wide pool for OCR calls and a cap on in-flight vision requests.
+# PaddleOCR engines are not thread-safe, so every OCR thread loads its own;
+# the pool size is therefore also the number of engines kept in memory.
+OCR_CONCURRENCY = int(os.environ.get("OCR_CONCURRENCY", min(4, os.cpu_count() or 1)))
+OCR_EXECUTOR = ThreadPoolExecutor(max_workers=OCR_CONCURRENCY, thread_name_prefix="ocr")
+_OCR_ENGINES = threading.local()
+VISION_CONCURRENCY = int(os.environ.get("VISION_CONCURRENCY", 8))
+
+def get_vision_semaphore() -> asyncio.Semaphore:
+    """Get the running event loop's cap on in-flight vision requests"""
+    return loop_local("vision_semaphore", lambda: asyncio.Semaphore(VISION_CONCURRENCY))
+
+def get_ocr_engine(lang: str = "en"):
+    """
+    Get the calling thread's PaddleOCR engine, creating it on first use
+    
+    PaddleOCR predictors share input/output tensors between calls, so an
+    engine must never be used from two threads at once. Call this (or
+    run_ocr_engine) only from OCR_EXECUTOR threads.
+    
+    Args:
+        lang: OCR language
+        
+    Returns:
+        PaddleOCR instance
+        
+    Raises:
+        RuntimeError: If no configuration could be initialized on this thread
+    """
+    engines = getattr(_OCR_ENGINES, "engines", None)
+    if engines is None:
+        engines = _OCR_ENGINES.engines = {}
+    if lang not in engines:
+        try:
+            engines[lang] = _create_ocr_engine(lang)
+        except RuntimeError:
+            # Remember the failure so every page doesn't retry each configuration
+            engines[lang] = None
+            raise
+    if engines[lang] is None:
+        raise RuntimeError("No PaddleOCR configuration could be initialized")
+    return engines[lang]
+
+def _create_ocr_engine(lang: str) -> Any:
+    """
+    Create a PaddleOCR engine using the fastest backend available
+    
+    On PaddleOCR 3.x, tries the high-performance inference path, which picks
+    ONNX Runtime / OpenVINO / TensorRT (forced with the IDP_OCR_BACKEND
+    environment variable). On 2.x, which silently ignores unknown options,
+    uses INT8-quantized ONNX models from IDP_OCR_ONNX_DIR when available and
+    otherwise MKL-DNN / TensorRT. Both fall back to the default configuration.
+    
+    The CPU threads are split between the OCR_CONCURRENCY engines.
+    
+    Args:
+        lang: OCR language
+        
+    Returns:
+        PaddleOCR instance
+        
+    Raises:
+        RuntimeError: If no configuration could be initialized
+    """
+    try:
+        import paddle
+        use_gpu = paddle.device.cuda.device_count() > 0
+    except Exception:
+        use_gpu = False
+        
+    cpu_threads = max(1, (os.cpu_count() or 1) // OCR_CONCURRENCY)
+    precision = "fp16" if use_gpu else "fp32"
+    
+    if PADDLEOCR_V3:
+        # Document orientation / unwarping are new in 3.x and off to match 2.x output
+        base_kwargs = {
+            "lang": lang,
+            "use_textline_orientation": True,
+            "use_doc_orientation_classify": False,
+            "use_doc_unwarping": False,
+            "device": "gpu" if use_gpu else "cpu"
+        }
+        hpi_kwargs = {"enable_hpi": True, "precision": precision, "cpu_threads": cpu_threads}
+        backend = os.environ.get("IDP_OCR_BACKEND")
+        if backend:
+            hpi_kwargs["hpi_config"] = {"backend": backend}
+        candidates = [hpi_kwargs, {}]
+    else:
+        base_kwargs = {"use_angle_cls": True, "lang": lang}
+        if use_gpu:
+            legacy_kwargs = {"use_gpu": True, "use_tensorrt": True, "precision": precision}
+        else:
+            legacy_kwargs = {"enable_mkldnn": True, "cpu_threads": cpu_threads}
+        candidates = [legacy_kwargs, {}]
+        
+        # Prefer INT8-quantized ONNX models built by quantize_ocr.py when present
+        onnx_dir = os.environ.get("IDP_OCR_ONNX_DIR")
+        if onnx_dir:
+            det_model = os.path.join(onnx_dir, "det.quant.onnx")
+            rec_model = os.path.join(onnx_dir, "rec.quant.onnx")
+            if os.path.exists(det_model) and os.path.exists(rec_model):
+                candidates.insert(0, {
+                    "use_onnx": True,
+                    "use_angle_cls": False,
+                    "det_model_dir": det_model,
+                    "rec_model_dir": rec_model,
+                    "cpu_threads": cpu_threads
+                })
+    
+    for kwargs in candidates:
+        try:
+            return PaddleOCR(**{**base_kwargs, **kwargs})
+        except Exception as e:
+            logger.warning("PaddleOCR init with %s failed: %s", kwargs, e)
+    raise RuntimeError("No PaddleOCR configuration could be initialized")
+
+def run_ocr_engine(image: Any, lang: str = "en") -> Any:
+    """
+    Run OCR on one image with the calling thread's engine
+    
+    Submit this to OCR_EXECUTOR; it makes the call the installed PaddleOCR
+    version expects.
+    
+    Args:
+        image: Image file path or BGR numpy array
+        lang: OCR language
+        
+    Returns:
+        Raw OCR output, to be passed to parse_ocr_result
+        
+    Raises:
+        RuntimeError: If the engine could not be initialized
+    """
+    ocr_engine = get_ocr_engine(lang)
+    if PADDLEOCR_V3:
+        return ocr_engine.predict(image)
+    return ocr_engine.ocr(image, cls=True)
+
+def parse_ocr_result(ocr_result: Any) -> Dict[str, Any]:
+    """
+    Convert raw PaddleOCR output into column arrays
+    
+    Keeping texts, positions and confidences as separate columns avoids
+    allocating a dict and boxed floats per detected line.
+    
+    Args:
+        ocr_result: Value returned by run_ocr_engine, or None
+        
+    Returns:
+        Dict with "texts" (list of str), "positions" (int32 array of shape
+        (N, 4, 2) holding the four corner points) and "confidences"
+        (float32 array of shape (N,))
+    """
+    if PADDLEOCR_V3:
+        # 3.x returns one result object per image holding parallel columns
+        results = [res for res in (ocr_result or []) if res]
+        texts = [text for res in results for text in res["rec_texts"]]
+        boxes = [box for res in results for box in res["rec_polys"]]
+        scores = [score for res in results for score in res["rec_scores"]]
+    else:
+        lines = [line for res in (ocr_result or []) if res for line in res]
+        texts = [line[1][0] for line in lines]
+        boxes = [line[0] for line in lines]
+        scores = [line[1][1] for line in lines]
+    return {
+        "texts": texts,
+        "positions": np.asarray(boxes, dtype=np.int32).reshape(-1, 4, 2),
+        "confidences": np.asarray(scores, dtype=np.float32)
+    }
+
+def merge_ocr_results(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Concatenate per-page OCR column arrays into one result
+    
+    Args:
+        results: Parsed OCR results in page order
+        
+    Returns:
+        Single result with the same columns as parse_ocr_result
+    """
+    if not results:
+        return parse_ocr_result(None)
+    return {
+        "texts": [text for result in results for text in result["texts"]],
+        "positions": np.concatenate([result["positions"] for result in results]),
+        "confidences": np.concatenate([result["confidences"] for result in results])
+    }
+
+_result_cache = None
+
+def _get_result_cache():
+    """Lazily open the shared result cache, or return None if unavailable"""
+    global _result_cache
+    if _result_cache is None and DISKCACHE_AVAILABLE:
+        cache_dir = os.environ.get("IDP_CACHE_DIR", os.path.join(tempfile.gettempdir(), "idp-ocr-cache"))
+        try:
+            _result_cache = diskcache.Cache(cache_dir)
+        except Exception as e:
+            logger.warning("Failed to open result cache at %s: %s", cache_dir, e)
+    return _result_cache
+
+async def _cache_get(key: Tuple) -> Any:
+    """Fetch a cached result without blocking the event loop"""
+    cache = _get_result_cache()
+    if cache is None:
+        return None
+    return await asyncio.to_thread(cache.get, key)
+
+async def _cache_set(key: Tuple, value: Any) -> None:
+    """Store a result in the cache without blocking the event loop"""
+    cache = _get_result_cache()
+    if cache is not None:
+        await asyncio.to_thread(cache.set, key, value)
+
 class ImageProcessor(BaseProcessor):
     """Processor for image-based documents with OCR capabilities"""
     
@@ -41,12 +288,10 @@ class ImageProcessor(BaseProcessor):
         self.llm = get_llm(
             model_name="gpt-4o",
             temperature=0.2,
+            json_mode=True,
             max_tokens=1500
         )
         
-        # Set up OCR engine (lazy initialization)
-        self._ocr_engine = None
-        
         # Set up templates
         self.system_template = """You are an OCR Image Analyst, an AI trained to extract structured information from images.
         
@@ -67,68 +312,150 @@ Follow these guidelines:
 {instructions}
 """
         
-    @property
-    def ocr_engine(self):
-        """Lazy initialization of OCR engine"""
-        if self._ocr_engine is None:
-            try:
-                self._ocr_engine = PaddleOCR(use_angle_cls=True, lang='en')
-            except Exception as e:
-                print(f"Warning: Failed to initialize PaddleOCR: {str(e)}")
-                self._ocr_engine = None
-        return self._ocr_engine
-        
-    async def _run_ocr(self, image_path: str) -> List[Dict[str, Any]]:
+    def _load_ocr_frames(self, image_path: str) -> Optional[List[np.ndarray]]:
+        """
+        Decode the pages of a multi-page TIFF for OCR
+        
+        PaddleOCR only reads the first frame of a TIFF given by path, so
+        each page is handed over as an array instead.
+        
+        Args:
+            image_path: Path to the image file
+            
+        Returns:
+            List of BGR page arrays, or None if the file is not a multi-page TIFF
+        """
+        try:
+            with Image.open(image_path) as image:
+                if image.format != "TIFF" or getattr(image, "n_frames", 1) <= 1:
+                    return None
+                # PaddleOCR expects OpenCV's BGR channel order
+                return [
+                    np.ascontiguousarray(np.asarray(frame.convert("RGB"))[:, :, ::-1])
+                    for frame in ImageSequence.Iterator(image)
+                ]
+        except Exception as e:
+            logger.warning("Multi-page OCR split skipped for %s: %s", image_path, e)
+            return None
+            
+    async def _run_ocr(self, image_path: str) -> Dict[str, Any]:
         """
         Run OCR on an image file using PaddleOCR
         
+        Pages of a multi-page TIFF are OCR'd concurrently on OCR_EXECUTOR,
+        each thread with its own engine, and merged in page order.
+        
         Args:
             image_path: Path to the image file
             
         Returns:
-            List of OCR results with text and positions
+            OCR results as column arrays (see parse_ocr_result)
         """
-        if not self.ocr_engine:
-            return []
+        if not OCR_AVAILABLE:
+            return parse_ocr_result(None)
             
         try:
-            # Run OCR (wrap in asyncio.to_thread for async execution)
-            ocr_result = await asyncio.to_thread(self.ocr_engine.ocr, image_path, cls=True)
+            # Run OCR on the shared OCR thread pool, with that thread's engine
+            loop = asyncio.get_running_loop()
+            frames = await asyncio.to_thread(self._load_ocr_frames, image_path)
+            if frames is None:
+                ocr_result = await loop.run_in_executor(OCR_EXECUTOR, run_ocr_engine, image_path)
+                parsed = parse_ocr_result(ocr_result)
+            else:
+                ocr_results = await asyncio.gather(*(
+                    loop.run_in_executor(OCR_EXECUTOR, run_ocr_engine, frame) for frame in frames
+                ))
+                parsed = merge_ocr_results([parse_ocr_result(result) for result in ocr_results])
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("OCR found %d lines in %s", len(parsed["texts"]), image_path)
+            return parsed
+        except Exception:
+            logger.exception("OCR failed for %s", image_path)
+            return parse_ocr_result(None)
             
-            # Process results
-            extracted_data = []
-            if ocr_result and len(ocr_result) > 0:
-                for idx, res in enumerate(ocr_result):
-                    if res:
-                        for line in res:
-                            position = line[0]  # [[x1,y1], [x2,y2], [x3,y3], [x4,y4]]
-                            text = line[1][0]   # Extracted text
-                            confidence = line[1][1]  # Confidence score
-                            
-                            extracted_data.append({
-                                "text": text,
-                                "position": position,
-                                "confidence": float(confidence)
-                            })
+    def _hash_file(self, file_path: str) -> str:
+        """
+        Compute the SHA-256 digest of a file's content
+        
+        Args:
+            file_path: Path to the file
             
-            return extracted_data
-        except Exception as e:
-            print(f"OCR error: {str(e)}")
-            return []
-    
-    def _encode_image(self, image_path: str) -> str:
+        Returns:
+            Hex digest of the file content
+        """
+        with open(file_path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return hashlib.sha256(b"").hexdigest()
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return hashlib.sha256(mapped).hexdigest()
+        
+    def _encode_image(self, image_path: str) -> Tuple[str, str]:
         """
         Encode image as base64 for API calls
         
+        Images larger than 1 MB or 2048px are downscaled and recompressed as
+        JPEG; smaller ones are sent as-is.
+        
         Args:
             image_path: Path to the image file
             
         Returns:
-            Base64-encoded image data
+            Tuple of (base64-encoded image data, MIME type)
         """
+        mime_type = mimetypes.guess_type(image_path)[0] or "image/jpeg"
+        
+        try:
+            with Image.open(image_path) as image:
+                if (mime_type not in _VISION_MIME_TYPES
+                        or os.path.getsize(image_path) > _MAX_PASSTHROUGH_BYTES
+                        or max(image.size) > _MAX_IMAGE_SIDE):
+                    # Re-encoding drops EXIF, so bake its orientation into the pixels first
+                    image = ImageOps.exif_transpose(image)
+                    image.thumbnail((_MAX_IMAGE_SIDE, _MAX_IMAGE_SIDE), Image.LANCZOS)
+                    if image.mode not in ("RGB", "L"):
+                        image = image.convert("RGB")
+                    buffer = BytesIO()
+                    image.save(buffer, "JPEG", quality=_JPEG_QUALITY, optimize=True)
+                    return base64.b64encode(buffer.getbuffer()).decode("ascii"), "image/jpeg"
+        except Exception as e:
+            logger.warning("Image downscaling skipped for %s: %s", image_path, e)
+        
         with open(image_path, "rb") as image_file:
-            encoded_string = base64.b64encode(image_file.read()).decode("utf-8")
-        return encoded_string
+            # mmap cannot map empty files
+            if os.fstat(image_file.fileno()).st_size == 0:
+                return "", mime_type
+            # Encode straight from the mapped file to avoid an intermediate read() copy
+            with mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                encoded_string = base64.b64encode(mapped).decode("ascii")
+        return encoded_string, mime_type
+        
+    def _encode_image_pages(self, image_path: str) -> List[str]:
+        """
+        Build vision data URLs for an image, one per page for multi-page TIFFs
+        
+        Args:
+            image_path: Path to the image file
+            
+        Returns:
+            List of data URLs labelled with their actual MIME type
+        """
+        try:
+            with Image.open(image_path) as image:
+                frame_count = getattr(image, "n_frames", 1)
+                if image.format == "TIFF" and frame_count > 1:
+                    urls = []
+                    for frame in ImageSequence.Iterator(image):
+                        page = ImageOps.exif_transpose(frame).convert("RGB")
+                        page.thumbnail((_MAX_IMAGE_SIDE, _MAX_IMAGE_SIDE), Image.LANCZOS)
+                        buffer = BytesIO()
+                        page.save(buffer, "PNG", optimize=True)
+                        urls.append(f"data:image/png;base64,{base64.b64encode(buffer.getbuffer()).decode('ascii')}")
+                    return urls
+        except Exception as e:
+            logger.warning("Multi-page split skipped for %s: %s", image_path, e)
+            
+        encoded_image, image_mime = self._encode_image(image_path)
+        return [f"data:{image_mime};base64,{encoded_image}"]
         
     async def process(self, file_path: str, instructions: Optional[str] = None) -> Dict[str, Any]:
         """
@@ -152,30 +479,35 @@ Follow these guidelines:
         if instructions:
             instruction_text = f"Additional instructions: {instructions}"
         
-        # Run OCR on the image
-        ocr_results = await self._run_ocr(file_path)
-        
-        # Set up the vision model prompt with the image
-        encoded_image = self._encode_image(file_path)
-        image_url = f"data:image/jpeg;base64,{encoded_image}"
-        
-        # Create the vision prompt
-        content = [
-            {
-                "type": "text",
-                "text": f"Analyze this image and extract all text content, organizing it into structured data. {instruction_text}"
-            },
-            {
-                "type": "image_url",
-                "image_url": {"url": image_url}
-            }
-        ]
+        # Identical content (retries, re-submits) reuses cached OCR and vision results
+        content_hash = await asyncio.to_thread(self._hash_file, file_path) if DISKCACHE_AVAILABLE else None
+        ocr_key = ("ocr", content_hash)
+        vision_key = ("vision", content_hash, instruction_text)
         
-        # Process the image using our vision model utility
-        text_prompt = f"Analyze this image and extract all text content, organizing it into structured data. {instruction_text}"
-        image_url = f"data:image/jpeg;base64,{encoded_image}"
+        async def get_ocr_results() -> Dict[str, Any]:
+            # Run OCR on the image
+            ocr_results = await _cache_get(ocr_key) if content_hash else None
+            if ocr_results is None:
+                ocr_results = await self._run_ocr(file_path)
+                if content_hash and ocr_results["texts"]:
+                    await _cache_set(ocr_key, ocr_results)
+            return ocr_results
         
-        result_dict = await run_vision_model(self.llm, text_prompt, image_url)
+        async def get_vision_result() -> Dict[str, Any]:
+            result_dict = await _cache_get(vision_key) if content_hash else None
+            if result_dict is None:
+                # Process the image using our vision model utility, which builds the message content
+                image_urls = await asyncio.to_thread(self._encode_image_pages, file_path)
+                text_prompt = f"Analyze this image and extract all text content, organizing it into structured data returned as a JSON object. {instruction_text}"
+                
+                async with get_vision_semaphore():
+                    result_dict = await run_vision_model(self.llm, text_prompt, image_urls)
+                if content_hash and result_dict.get("success", False):
+                    await _cache_set(vision_key, result_dict)
+            return result_dict
+        
+        # OCR and the vision call are independent, so run them concurrently
+        ocr_results, result_dict = await asyncio.gather(get_ocr_results(), get_vision_result())
         
         # Create a compatible result object
         if result_dict.get("success", False):
@@ -187,22 +519,9 @@ Follow these guidelines:
         # Extract structured data from the result
         analysis = result_content
         
-        # Try to parse as JSON if it looks like JSON
-        structured_data = {}
-        try:
-            # Check if the result contains a JSON object
-            if "{" in analysis and "}" in analysis:
-                # Try to extract JSON from the text
-                json_start = analysis.find("{")
-                json_end = analysis.rfind("}") + 1
-                json_str = analysis[json_start:json_end]
-                
-                structured_data = json.loads(json_str)
-            else:
-                # If not JSON, keep as text
-                structured_data = {"extracted_text": analysis}
-        except json.JSONDecodeError:
-            # If JSON parsing fails, keep as text
+        # Try to parse as JSON, keeping the raw text if no JSON object is found
+        structured_data = parse_llm_json(analysis)
+        if structured_data is None:
             structured_data = {"extracted_text": analysis}
         
         # Combine OCR and vision analysis results
@@ -243,14 +562,11 @@ Follow these guidelines:
                 "instructions": instructions
             }
         except Exception as e:
-            import traceback
-            error_traceback = traceback.format_exc()
-            print(f"Error in run_with_tracing for ImageProcessor: {str(e)}\n{error_traceback}")
+            logger.exception("ImageProcessor failed for %s", file_path)
             
             return {
                 "status": "error",
-                "error": str(e),
-                "traceback": error_traceback,
+                "error": f"{type(e).__name__}: {e}",
                 "file_path": file_path,
                 "file_type": "image"
             }
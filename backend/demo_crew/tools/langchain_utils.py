@@ -4,11 +4,41 @@ This module handles version differences and provides fallbacks for missing funct
 """
 import os
 import sys
+import re
+import json
+import asyncio
 import logging
+import weakref
 from typing import Dict, Any, Optional, List, Union, Callable
 
 logger = logging.getLogger(__name__)
 
+# Prefer orjson for parsing model output; fall back to the stdlib parser
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# Retry transient OpenAI failures (rate limits, timeouts) with jittered backoff
+try:
+    from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+    TENACITY_AVAILABLE = True
+except ImportError:
+    TENACITY_AVAILABLE = False
+
+# Client-side request rate cap so we don't trip the provider's rate limit
+try:
+    from aiolimiter import AsyncLimiter
+    AIOLIMITER_AVAILABLE = True
+except ImportError:
+    AIOLIMITER_AVAILABLE = False
+_LLM_RPS = float(os.environ.get("LLM_RPS", 10))
+
+# Outermost {...} span in free-form model output
+_JSON_RE = re.compile(r'\{.*\}', re.S)
+_JSON_DECODER = json.JSONDecoder()
+
 # Check if we have working LangChain imports
 try:
     import langchain
@@ -46,30 +76,187 @@ except ImportError as e:
 
 # Re-export these classes so they can be imported from this module
 __all__ = ['ChatOpenAI', 'HumanMessage', 'SystemMessage', 'ChatPromptTemplate', 
-           'get_llm', 'create_prompt', 'run_llm_chain', 'run_vision_model', 'LANGCHAIN_AVAILABLE']
+           'get_llm', 'create_prompt', 'run_llm_chain', 'run_vision_model', 'json_loads',
+           'json_dumps', 'parse_llm_json', 'LANGCHAIN_AVAILABLE']
 
-def get_llm(model_name: str = "gpt-4-turbo", temperature: float = 0.2, **kwargs) -> ChatOpenAI:
+def json_loads(data: Union[str, bytes]) -> Any:
     """
-    Get a LangChain LLM with proper error handling
+    Parse JSON using orjson when available
+    
+    Args:
+        data: JSON document as str or bytes
+        
+    Returns:
+        Parsed Python object
+        
+    Raises:
+        json.JSONDecodeError: If the document is not valid JSON
+    """
+    if ORJSON_AVAILABLE:
+        # orjson.JSONDecodeError subclasses json.JSONDecodeError
+        return orjson.loads(data)
+    return json.loads(data)
+
+def _json_default(obj: Any) -> Any:
+    """Convert numpy arrays/scalars for the stdlib encoder"""
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def json_dumps(obj: Any, indent: bool = False) -> bytes:
+    """
+    Serialize processing results to UTF-8 JSON using orjson when available
+    
+    Numpy arrays and scalars (e.g. OCR positions) are serialized directly.
+    
+    Args:
+        obj: Object to serialize
+        indent: Pretty-print with two-space indentation
+        
+    Returns:
+        Encoded JSON document
+    """
+    if ORJSON_AVAILABLE:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option)
+    return json.dumps(obj, indent=2 if indent else None, default=_json_default).encode("utf-8")
+
+def parse_llm_json(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Extract a JSON object embedded in LLM output
+    
+    Args:
+        text: Raw model output, possibly with prose around the JSON
+        
+    Returns:
+        Parsed JSON object, or None if no valid object was found
+    """
+    # JSON-mode responses are a bare object, so try the whole text first
+    try:
+        parsed = json_loads(text)
+        if isinstance(parsed, dict):
+            return parsed
+    except json.JSONDecodeError:
+        pass
+        
+    match = _JSON_RE.search(text)
+    if not match:
+        return None
+        
+    try:
+        return json_loads(match.group())
+    except json.JSONDecodeError:
+        pass
+        
+    # Trailing prose may contain stray braces; decode the first complete object instead
+    try:
+        obj, _ = _JSON_DECODER.raw_decode(text, match.start())
+        return obj
+    except json.JSONDecodeError:
+        return None
+
+# Loop-bound objects (HTTP pools, semaphores, limiters) kept per event loop.
+# upload.py runs every upload in its own short-lived loop, so nothing that
+# binds to a loop may be shared across them.
+_LOOP_STATE = weakref.WeakKeyDictionary()
+
+def _running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    """Return the running event loop, or None when called from sync code"""
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+def loop_local(name: str, factory: Callable[[], Any]) -> Any:
+    """
+    Get an object that is shared within the running event loop only
+    
+    Args:
+        name: Key identifying the object within the loop
+        factory: Called to create the object the first time a loop asks for it
+        
+    Returns:
+        The loop's instance, or a fresh unshared one when no loop is running
+    """
+    loop = _running_loop()
+    if loop is None:
+        return factory()
+    state = _LOOP_STATE.setdefault(loop, {})
+    if name not in state:
+        state[name] = factory()
+    return state[name]
+
+async def release_loop_resources() -> None:
+    """
+    Close and forget the running loop's shared objects
+    
+    Call this before closing a short-lived event loop so its HTTP pool
+    is shut down cleanly instead of being left to a closed loop.
+    """
+    loop = _running_loop()
+    state = _LOOP_STATE.pop(loop, None) if loop is not None else None
+    client = (state or {}).get("http_client")
+    if client is not None:
+        await client.aclose()
+
+def _make_async_http_client() -> Any:
+    """
+    Create an async HTTP client for LLM requests
+    
+    Uses HTTP/2 when the h2 package is installed so concurrent completions
+    multiplex over a single TLS connection.
+    
+    Returns:
+        httpx.AsyncClient instance, or None if httpx is unavailable
+    """
+    try:
+        import httpx
+    except ImportError:
+        return None
+    limits = httpx.Limits(max_connections=64, max_keepalive_connections=32)
+    timeout = httpx.Timeout(600.0, connect=10.0)
+    try:
+        return httpx.AsyncClient(limits=limits, timeout=timeout, http2=True)
+    except ImportError:
+        # h2 is not installed; fall back to HTTP/1.1 with the same pool
+        return httpx.AsyncClient(limits=limits, timeout=timeout)
+
+def _create_llm(model_name: str, temperature: float, api_key: str, json_mode: bool, kwargs: Dict[str, Any]) -> ChatOpenAI:
+    """
+    Create a ChatOpenAI instance, on the running loop's shared HTTP client if there is one
     
     Args:
         model_name: Name of the model to use
         temperature: Temperature for generation
-        **kwargs: Additional arguments to pass to the LLM
+        api_key: OpenAI API key
+        json_mode: Ask the API to return a single JSON object
+        kwargs: Additional arguments to pass to the LLM
         
     Returns:
-        ChatOpenAI instance or dummy if not available
+        ChatOpenAI instance or dummy if creation failed
     """
-    if not LANGCHAIN_AVAILABLE:
-        logger.warning("LangChain not available, returning dummy LLM")
-        return ChatOpenAI()
+    if json_mode:
+        model_kwargs = dict(kwargs.get("model_kwargs") or {})
+        model_kwargs["response_format"] = {"type": "json_object"}
+        kwargs = dict(kwargs, model_kwargs=model_kwargs)
+        
+    if TENACITY_AVAILABLE:
+        # _ainvoke_with_retry is the only retry layer; the SDK's own retries would stack on it
+        kwargs = {"max_retries": 0, **kwargs}
         
     try:
-        # Get API key from environment
-        api_key = os.environ.get("OPENAI_API_KEY")
-        if not api_key:
-            logger.warning("OPENAI_API_KEY not found in environment")
-            return ChatOpenAI()
+        # Outside a running loop there is no loop to share a pool with
+        http_async_client = loop_local("http_client", _make_async_http_client) if _running_loop() else None
+        if http_async_client is not None:
+            return ChatOpenAI(
+                model=model_name,
+                temperature=temperature,
+                openai_api_key=api_key,
+                http_async_client=http_async_client,
+                **kwargs
+            )
             
         # Create and return the LLM
         return ChatOpenAI(
@@ -81,6 +268,93 @@ def get_llm(model_name: str = "gpt-4-turbo", temperature: float = 0.2, **kwargs)
     except Exception as e:
         logger.error(f"Error creating LLM: {str(e)}")
         return ChatOpenAI()
+
+def get_llm(model_name: str = "gpt-4-turbo", temperature: float = 0.2, json_mode: bool = False, **kwargs) -> ChatOpenAI:
+    """
+    Get a LangChain LLM with proper error handling
+    
+    Identical configurations share one instance (and its connection pool)
+    within the running event loop.
+    
+    Args:
+        model_name: Name of the model to use
+        temperature: Temperature for generation
+        json_mode: Use OpenAI JSON mode so the response is always a JSON object
+            (the prompt must mention JSON)
+        **kwargs: Additional arguments to pass to the LLM
+        
+    Returns:
+        ChatOpenAI instance or dummy if not available
+    """
+    if not LANGCHAIN_AVAILABLE:
+        logger.warning("LangChain not available, returning dummy LLM")
+        return ChatOpenAI()
+        
+    # Get API key from environment
+    api_key = os.environ.get("OPENAI_API_KEY")
+    if not api_key:
+        logger.warning("OPENAI_API_KEY not found in environment")
+        return ChatOpenAI()
+        
+    if _running_loop() is None:
+        return _create_llm(model_name, temperature, api_key, json_mode, kwargs)
+        
+    try:
+        key = (model_name, temperature, api_key, json_mode, tuple(sorted(kwargs.items())))
+        llms = loop_local("llms", dict)
+        if key not in llms:
+            llms[key] = _create_llm(model_name, temperature, api_key, json_mode, kwargs)
+        return llms[key]
+    except TypeError:
+        # Unhashable arguments (e.g. dicts) can't be memoized
+        return _create_llm(model_name, temperature, api_key, json_mode, kwargs)
+        
+def _is_retryable(error: BaseException) -> bool:
+    """
+    Decide whether an LLM call failure is transient and worth retrying
+    
+    Args:
+        error: Exception raised by the LLM call
+        
+    Returns:
+        True for rate limits and timeouts, False otherwise
+    """
+    if getattr(error, "status_code", None) == 429:
+        return True
+    if type(error).__name__ in ("RateLimitError", "APITimeoutError", "APIConnectionError"):
+        return True
+    message = str(error).lower()
+    return "rate limit" in message or "timed out" in message
+
+async def _ainvoke_with_retry(runnable: Any, inputs: Any) -> Any:
+    """
+    Invoke a LangChain runnable with rate limiting and retries on transient errors
+    
+    Args:
+        runnable: Chain or LLM exposing ainvoke
+        inputs: Inputs passed to ainvoke
+        
+    Returns:
+        The runnable's result
+    """
+    async def _invoke():
+        if not AIOLIMITER_AVAILABLE:
+            return await runnable.ainvoke(inputs)
+        async with loop_local("llm_limiter", lambda: AsyncLimiter(_LLM_RPS, 1)):
+            return await runnable.ainvoke(inputs)
+    
+    if not TENACITY_AVAILABLE:
+        return await _invoke()
+        
+    async for attempt in AsyncRetrying(
+        retry=retry_if_exception(_is_retryable),
+        wait=wait_random_exponential(min=1, max=30),
+        stop=stop_after_attempt(3),
+        reraise=True
+    ):
+        with attempt:
+            result = await _invoke()
+    return result
         
 def create_prompt(system_template: str, human_template: str) -> Optional[ChatPromptTemplate]:
     """
@@ -137,7 +411,7 @@ async def run_llm_chain(
     try:
         # Create and run the chain
         chain = prompt | llm
-        result = await chain.ainvoke(inputs)
+        result = await _ainvoke_with_retry(chain, inputs)
         return {"content": result.content, "success": True}
     except Exception as e:
         import traceback
@@ -154,7 +428,7 @@ async def run_llm_chain(
 async def run_vision_model(
     llm: Optional[ChatOpenAI],
     text_prompt: str,
-    image_data: str
+    image_data: Union[str, List[str]]
 ) -> Dict[str, Any]:
     """
     Run a vision model on text + image data with error handling
@@ -162,7 +436,7 @@ async def run_vision_model(
     Args:
         llm: Vision-capable LLM
         text_prompt: Text prompt to accompany the image
-        image_data: Base64 encoded image data or image URL
+        image_data: Base64 data URL or image URL, or a list of them for multi-page images
         
     Returns:
         Dict with results or error information
@@ -181,19 +455,22 @@ async def run_vision_model(
         
     try:
         # Format content for vision model
+        image_urls = [image_data] if isinstance(image_data, str) else image_data
         content = [
             {
                 "type": "text",
                 "text": text_prompt
-            },
+            }
+        ] + [
             {
                 "type": "image_url",
-                "image_url": {"url": image_data}
+                "image_url": {"url": image_url}
             }
+            for image_url in image_urls
         ]
         
         # Call the vision model
-        result = await llm.ainvoke([HumanMessage(content=content)])
+        result = await _ainvoke_with_retry(llm, [HumanMessage(content=content)])
         return {"content": result.content, "success": True}
     except Exception as e:
         import traceback
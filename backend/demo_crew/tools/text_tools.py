@@ -2,29 +2,72 @@
 Text processor for handling text-based documents.
 """
 import os
-import json
+import mmap
+import logging
+import base64
 import asyncio
-from typing import Dict, Any, Optional, List
+import threading
+from io import BytesIO
+from typing import Dict, Any, Optional, List, Tuple
 import mimetypes
 
+logger = logging.getLogger(__name__)
+
 # Import the utility module for LangChain compatibility
 from .langchain_utils import (
     get_llm, 
     create_prompt, 
     run_llm_chain, 
-    LANGCHAIN_AVAILABLE,
-    ChatPromptTemplate
+    run_vision_model,
+    parse_llm_json,
+    LANGCHAIN_AVAILABLE
 )
 
 from .base_processor import BaseProcessor
+from .image_tools import (
+    run_ocr_engine,
+    parse_ocr_result,
+    get_vision_semaphore,
+    OCR_AVAILABLE,
+    OCR_CONCURRENCY,
+    OCR_EXECUTOR
+)
+
+# Scanned PDF pages are rendered at this DPI for OCR
+_SCAN_DPI = 150
+# Pages whose mean OCR confidence falls below this are read by the vision model
+_MIN_OCR_CONFIDENCE = 0.6
+# Without OCR, longer scanned PDFs are not sent page by page to the vision model
+_MAX_VISION_PAGES = int(os.environ.get("MAX_VISION_PAGES", 20))
+
+# PDF processing: PDFium (C++ engine) first, pypdf/PyPDF2 as fallback
+try:
+    import pypdfium2 as pdfium
+    PDFIUM_AVAILABLE = True
+except ImportError:
+    PDFIUM_AVAILABLE = False
+
+# PDFium is not thread-safe, even across documents; every call into it holds this lock
+_PDFIUM_LOCK = threading.Lock()
 
-# PDF processing
 try:
-    import PyPDF2
+    from pypdf import PdfReader
     PDF_AVAILABLE = True
 except ImportError:
-    PDF_AVAILABLE = False
-    print("Warning: PyPDF2 is not available. PDF processing will be limited.")
+    try:
+        from PyPDF2 import PdfReader
+        PDF_AVAILABLE = True
+    except ImportError:
+        PDF_AVAILABLE = False
+        if not PDFIUM_AVAILABLE:
+            logger.warning("No PDF library is available. PDF processing will be limited.")
+
+# Encoding detection for files that are not valid UTF-8
+try:
+    from charset_normalizer import from_bytes
+    CHARSET_DETECTION_AVAILABLE = True
+except ImportError:
+    CHARSET_DETECTION_AVAILABLE = False
 
 class TextProcessor(BaseProcessor):
     """Processor for text-based documents"""
@@ -35,7 +78,10 @@ class TextProcessor(BaseProcessor):
         self.name = "TextProcessor"
         
         # Initialize the language model using our utility function
-        self.llm = get_llm(model_name="gpt-4-turbo", temperature=0.2)
+        self.llm = get_llm(model_name="gpt-4-turbo", temperature=0.2, json_mode=True)
+        
+        # Vision model for low-confidence scanned pages (lazy initialization)
+        self._vision_llm = None
         
         # Set up templates
         self.system_template = """You are a Text Data Specialist, an AI trained to extract structured information from text documents.
@@ -57,6 +103,221 @@ Follow these guidelines:
 {instructions}
 """
         
+        # Build the prompt once; only the instructions vary per request
+        self._base_prompt = create_prompt(
+            system_template=self.system_template,
+            human_template="Here is the text content to analyze and extract information from:\n\n{content}"
+        )
+        
+    @property
+    def vision_llm(self):
+        """Lazy initialization of the vision model used for scanned pages"""
+        if self._vision_llm is None:
+            self._vision_llm = get_llm(model_name="gpt-4o", temperature=0.2, max_tokens=1500)
+        return self._vision_llm
+        
+    def _render_pdf_page(self, pdf: Any, index: int) -> Any:
+        """
+        Render a single PDF page for OCR
+        
+        Args:
+            pdf: Open pypdfium2 document
+            index: Zero-based page index
+            
+        Returns:
+            Rendered page as a BGR numpy array
+        """
+        with _PDFIUM_LOCK:
+            page = pdf[index]
+            try:
+                bitmap = page.render(scale=_SCAN_DPI / 72)
+                # Copy out of PDFium's buffer, which is released with the bitmap
+                return bitmap.to_numpy().copy()
+            finally:
+                page.close()
+                
+    def _render_pdf_page_jpeg(self, pdf: Any, index: int) -> str:
+        """
+        Render a single PDF page as a JPEG data URL for the vision model
+        
+        Args:
+            pdf: Open pypdfium2 document
+            index: Zero-based page index
+            
+        Returns:
+            Base64 JPEG data URL of the page
+        """
+        with _PDFIUM_LOCK:
+            page = pdf[index]
+            try:
+                # convert() copies out of PDFium's buffer so the bitmap is freed under the lock
+                image = page.render(scale=_SCAN_DPI / 72).to_pil().convert("RGB")
+            finally:
+                page.close()
+                
+        buffer = BytesIO()
+        image.save(buffer, "JPEG", quality=85)
+        return f"data:image/jpeg;base64,{base64.b64encode(buffer.getvalue()).decode('ascii')}"
+        
+    def _open_pdf(self, file_path: str) -> Any:
+        """Open a PDF with PDFium under the process-wide lock"""
+        with _PDFIUM_LOCK:
+            return pdfium.PdfDocument(file_path)
+            
+    def _close_pdf(self, pdf: Any) -> None:
+        """Close a PDFium document under the process-wide lock"""
+        with _PDFIUM_LOCK:
+            pdf.close()
+            
+    async def _read_page_with_vision(self, pdf: Any, index: int) -> str:
+        """
+        Transcribe a PDF page with the vision model
+        
+        The page is rendered only once a vision slot is free, so waiting
+        pages don't hold their bitmaps in memory.
+        
+        Args:
+            pdf: Open pypdfium2 document
+            index: Zero-based page index
+            
+        Returns:
+            Page text, or an empty string if the call failed
+        """
+        async with get_vision_semaphore():
+            image_url = await asyncio.to_thread(self._render_pdf_page_jpeg, pdf, index)
+            result_dict = await run_vision_model(
+                self.vision_llm,
+                "Transcribe all text on this scanned page. Return only the text.",
+                image_url
+            )
+        return result_dict.get("content", "") if result_dict.get("success", False) else ""
+        
+    async def _ocr_scanned_pdf(self, file_path: str) -> str:
+        """
+        Recover text from a scanned PDF by rendering pages straight into OCR
+        
+        Pages are OCR'd concurrently (bounded by OCR_CONCURRENCY); only pages
+        with low OCR confidence are sent to the vision model. Without an OCR
+        engine, only documents of up to _MAX_VISION_PAGES pages are read by
+        the vision model.
+        
+        Args:
+            file_path: Path to the PDF file
+            
+        Returns:
+            Recovered text with pages separated by blank lines
+        """
+        if not PDFIUM_AVAILABLE:
+            return ""
+            
+        if not OCR_AVAILABLE:
+            logger.warning("OCR unavailable for scanned PDF %s", file_path)
+            
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(OCR_CONCURRENCY)
+        pdf = await asyncio.to_thread(self._open_pdf, file_path)
+        
+        async def read_page(index: int) -> str:
+            page_ocr = parse_ocr_result(None)
+            ocr_succeeded = False
+            if OCR_AVAILABLE:
+                async with semaphore:
+                    try:
+                        bitmap = await asyncio.to_thread(self._render_pdf_page, pdf, index)
+                        # Each OCR thread runs its own engine, so pages never share one
+                        ocr_result = await loop.run_in_executor(OCR_EXECUTOR, run_ocr_engine, bitmap)
+                        page_ocr = parse_ocr_result(ocr_result)
+                        ocr_succeeded = True
+                    except Exception:
+                        logger.exception("OCR failed on page %d of %s", index + 1, file_path)
+                        
+            texts = page_ocr["texts"]
+            ocr_text = "\n".join(texts)
+            if ocr_succeeded and not texts:
+                # Blank page
+                return ""
+            if texts and float(page_ocr["confidences"].mean()) >= _MIN_OCR_CONFIDENCE:
+                return ocr_text
+                
+            # Low confidence or OCR failure: let the vision model read the page
+            try:
+                return await self._read_page_with_vision(pdf, index) or ocr_text
+            except Exception:
+                logger.exception("Vision fallback failed on page %d of %s", index + 1, file_path)
+                return ocr_text
+        
+        try:
+            page_count = len(pdf)
+            if not OCR_AVAILABLE and page_count > _MAX_VISION_PAGES:
+                logger.warning(
+                    "OCR unavailable and %s has %d pages; skipping vision transcription", file_path, page_count
+                )
+                return ""
+            pages = await asyncio.gather(*(read_page(index) for index in range(page_count)))
+        finally:
+            await asyncio.to_thread(self._close_pdf, pdf)
+        return "\n\n".join(pages)
+        
+    def _read_text_file(self, file_path: str) -> str:
+        """
+        Read a text file, detecting the encoding if it is not UTF-8
+        
+        Args:
+            file_path: Path to the text file
+            
+        Returns:
+            Decoded file content
+        """
+        with open(file_path, 'rb') as f:
+            # mmap cannot map empty files
+            if os.fstat(f.fileno()).st_size == 0:
+                return ""
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                data = mapped[:]
+                
+        try:
+            return data.decode('utf-8')
+        except UnicodeDecodeError:
+            if CHARSET_DETECTION_AVAILABLE:
+                best_match = from_bytes(data).best()
+                if best_match is not None:
+                    return str(best_match)
+            return data.decode('utf-8', 'replace')
+        
+    def _extract_pdf_text(self, file_path: str) -> Tuple[str, int]:
+        """
+        Extract the text layer of a PDF
+        
+        Args:
+            file_path: Path to the PDF file
+            
+        Returns:
+            Tuple of (extracted text with pages separated by blank lines, page count)
+        """
+        if PDFIUM_AVAILABLE:
+            try:
+                with _PDFIUM_LOCK:
+                    pdf = pdfium.PdfDocument(file_path)
+                    try:
+                        parts = []
+                        for page in pdf:
+                            textpage = page.get_textpage()
+                            parts.append(textpage.get_text_range())
+                            # Close explicitly so PDFium's page cache doesn't grow with the document
+                            textpage.close()
+                            page.close()
+                        return "\n\n".join(parts), len(pdf)
+                    finally:
+                        pdf.close()
+            except Exception as e:
+                logger.warning("PDFium extraction failed for %s, falling back to pypdf: %s", file_path, e)
+                
+        # Join pages once instead of growing a string
+        with open(file_path, 'rb') as f:
+            pdf_reader = PdfReader(f)
+            content = "\n\n".join(page.extract_text() or "" for page in pdf_reader.pages)
+            return content, len(pdf_reader.pages)
+        
     async def process(self, file_path: str, instructions: Optional[str] = None) -> Dict[str, Any]:
         """
         Process a text file and extract structured information
@@ -84,44 +345,26 @@ Follow these guidelines:
         content = ""
         if file_ext.lower() == '.pdf':
             # Handle PDF files specially
-            if PDF_AVAILABLE:
+            if PDFIUM_AVAILABLE or PDF_AVAILABLE:
                 try:
-                    # Read PDF with PyPDF2
-                    with open(file_path, 'rb') as f:
-                        pdf_reader = PyPDF2.PdfReader(f)
-                        for page_num in range(len(pdf_reader.pages)):
-                            page = pdf_reader.pages[page_num]
-                            content += page.extract_text() + "\n\n"
+                    content, page_count = await asyncio.to_thread(self._extract_pdf_text, file_path)
                     
-                    # If content is empty, PDF might be scanned/image-based
-                    if not content.strip():
-                        content = "This appears to be a scanned PDF without extractable text. OCR processing is required."
+                    # If pages exist but have no text, PDF might be scanned/image-based
+                    if not content.strip() and page_count > 0:
+                        content = await self._ocr_scanned_pdf(file_path)
+                        if not content.strip():
+                            content = "This appears to be a scanned PDF without extractable text. OCR processing is required."
                 except Exception as e:
                     content = f"Error extracting text from PDF: {str(e)}"
-                    print(f"PDF extraction error for {file_path}: {str(e)}")
+                    logger.exception("PDF extraction failed for %s", file_path)
             else:
-                content = "PDF processing is not available. Please install PyPDF2 to enable PDF text extraction."
+                content = "PDF processing is not available. Please install pypdfium2 or pypdf to enable PDF text extraction."
         else:
             # Read regular text files
-            try:
-                with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
-                    content = f.read()
-            except UnicodeDecodeError:
-                # Try binary mode as fallback for problematic files
-                with open(file_path, 'rb') as f:
-                    content = str(f.read())
-        
-        # Set up the prompt
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", self.system_template.format(instructions=instruction_text)),
-            ("human", "Here is the text content to analyze and extract information from:\n\n{content}")
-        ])
-        
-        # Create a proper prompt using our utility function
-        prompt = create_prompt(
-            system_template=self.system_template.format(instructions=instruction_text),
-            human_template="Here is the text content to analyze and extract information from:\n\n{content}"
-        )
+            content = self._read_text_file(file_path)
+        
+        # Bind the instructions to the prebuilt prompt
+        prompt = self._base_prompt.partial(instructions=instruction_text) if self._base_prompt else None
         
         # Run the LLM chain using our utility function
         result_dict = await run_llm_chain(prompt, self.llm, {"content": content})
@@ -136,22 +379,9 @@ Follow these guidelines:
         # Extract structured data 
         extracted_text = result_content
         
-        # Try to parse as JSON if it looks like JSON
-        structured_data = {}
-        try:
-            # Check if the result contains a JSON object
-            if "{" in extracted_text and "}" in extracted_text:
-                # Try to extract JSON from the text
-                json_start = extracted_text.find("{")
-                json_end = extracted_text.rfind("}") + 1
-                json_str = extracted_text[json_start:json_end]
-                
-                structured_data = json.loads(json_str)
-            else:
-                # If not JSON, keep as text
-                structured_data = {"extracted_text": extracted_text}
-        except json.JSONDecodeError:
-            # If JSON parsing fails, keep as text
+        # Try to parse as JSON, keeping the raw text if no JSON object is found
+        structured_data = parse_llm_json(extracted_text)
+        if structured_data is None:
             structured_data = {"extracted_text": extracted_text}
         
         # Add metadata
@@ -163,6 +393,21 @@ Follow these guidelines:
             "mime_type": mimetypes.guess_type(file_path)[0] or "text/plain"
         }
         
+    async def process_many(self, file_paths: List[str], instructions: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Process several text files concurrently
+        
+        LLM requests still go through the shared rate limiter in langchain_utils.
+        
+        Args:
+            file_paths: Paths to the text files
+            instructions: Optional specific instructions applied to every file
+            
+        Returns:
+            List of processing results in the same order as file_paths
+        """
+        return await asyncio.gather(*(self.process(file_path, instructions) for file_path in file_paths))
+        
     async def run_with_tracing(self, file_path: str, instructions: Optional[str] = None) -> Dict[str, Any]:
         """
         Process a text file with tracing if available, falls back to regular processing if not
@@ -187,14 +432,11 @@ Follow these guidelines:
                 "instructions": instructions
             }
         except Exception as e:
-            import traceback
-            error_traceback = traceback.format_exc()
-            print(f"Error in run_with_tracing for TextProcessor: {str(e)}\n{error_traceback}")
+            logger.exception("TextProcessor failed for %s", file_path)
             
             return {
                 "status": "error",
-                "error": str(e),
-                "traceback": error_traceback,
+                "error": f"{type(e).__name__}: {e}",
                 "file_path": file_path,
                 "file_type": "text"
             }
@@ -2,25 +2,262 @@
 Video processor for handling video files with transcription and analysis capabilities.
 """
 import os
-import json
 import asyncio
-import tempfile
-from typing import Dict, Any, Optional, List
+import math
+import functools
+import shutil
+import subprocess
+import multiprocessing
+import threading
+from fractions import Fraction
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, Optional, List, Tuple
 import mimetypes
 
+import numpy as np
+
 try:
-    import whisper
     from moviepy.editor import VideoFileClip
-    import numpy as np
 except ImportError:
-    # Fallback to basic functionality if dependencies aren't available
-    pass
+    try:
+        # moviepy 2.x removed the moviepy.editor module
+        from moviepy import VideoFileClip
+    except ImportError:
+        # Fallback to basic functionality if dependencies aren't available
+        pass
+
+try:
+    import whisper
+    import torch
+    WHISPER_AVAILABLE = True
+except ImportError:
+    WHISPER_AVAILABLE = False
+
+# moviepy ships an ffmpeg binary through imageio-ffmpeg; use it when there is no system one
+try:
+    from imageio_ffmpeg import get_ffmpeg_exe
+    FFMPEG_BINARY = get_ffmpeg_exe()
+except Exception:
+    FFMPEG_BINARY = "ffmpeg"
+
+# ffprobe reads container metadata without opening decoders; not bundled with moviepy
+FFPROBE_BINARY = shutil.which("ffprobe")
+
+# Whisper expects 16 kHz mono float32 PCM
+_SAMPLE_RATE = 16000
+
+# Prefer the CTranslate2 Whisper port (int8 weights, fused kernels) when installed
+try:
+    from faster_whisper import WhisperModel
+    import ctranslate2
+    FASTER_WHISPER_AVAILABLE = True
+except ImportError:
+    FASTER_WHISPER_AVAILABLE = False
+
+# Batched pipeline (faster-whisper >= 1.1) encodes many 30s windows per GPU call
+try:
+    from faster_whisper import BatchedInferencePipeline
+except ImportError:
+    BatchedInferencePipeline = None
+
+# Transcription is CPU/GPU heavy Python, so it runs in worker processes rather
+# than threads; each worker keeps its own models since they can't be pickled
+_VIDEO_WORKERS = int(os.environ.get("VIDEO_WORKERS", 2))
+_WHISPER_MODEL = os.environ.get("VIDEO_WHISPER_MODEL", "base")
+_BATCH_SIZE = int(os.environ.get("VIDEO_BATCH_SIZE", 8))
+_WINDOW_SECONDS = 30
+_transcribe_pool = None
+# Uploads run on separate threads, so the first ones may race to create the pool
+_transcribe_pool_lock = threading.Lock()
+
+# Loaded Whisper models keyed by (model name, device, compute type)
+_MODEL_CACHE: Dict[Tuple[str, str, str], Any] = {}
+
+@functools.lru_cache(maxsize=1)
+def _select_backend() -> Tuple[str, str, str]:
+    """
+    Pick the Whisper backend, device and compute type for this host
+    
+    Returns:
+        Tuple of (backend name, device, compute type)
+    """
+    if FASTER_WHISPER_AVAILABLE:
+        # int8 weights with fp16 activations where the GPU supports it
+        if ctranslate2.get_cuda_device_count() > 0:
+            supported = ctranslate2.get_supported_compute_types("cuda")
+            return "faster-whisper", "cuda", "int8_float16" if "int8_float16" in supported else "float16"
+        return "faster-whisper", "cpu", "int8"
+        
+    # Run on the GPU when one is present; Whisper's encoder is matmul-bound.
+    # openai-whisper only decodes in fp16 or fp32 (bf16 fails its dtype check)
+    if torch.cuda.is_available():
+        return "whisper", "cuda", "float16"
+    return "whisper", "cpu", "float32"
+
+def _get_transcription_model(model_name: str = _WHISPER_MODEL) -> Tuple[Any, str, str]:
+    """
+    Get a Whisper model for this process, loading it on first use
+    
+    Args:
+        model_name: Whisper model size or path
+        
+    Returns:
+        Tuple of (model, backend name, device)
+    """
+    backend, device, compute_type = _select_backend()
+    key = (model_name, device, compute_type)
+    model = _MODEL_CACHE.get(key)
+    if model is None:
+        if backend == "faster-whisper":
+            model = WhisperModel(model_name, device=device, compute_type=compute_type)
+        else:
+            model = whisper.load_model(model_name, device=device)
+        _MODEL_CACHE[key] = model
+    return model, backend, device
+
+def _preload_transcription_model() -> None:
+    """Load the default model when a worker starts so the first job doesn't pay for it"""
+    try:
+        _get_transcription_model()
+    except Exception as e:
+        # Leave loading to the first job, which will report the error
+        print(f"Warning: Failed to preload Whisper model: {str(e)}")
+
+def _get_transcribe_pool() -> ProcessPoolExecutor:
+    """
+    Get the shared transcription process pool, creating it on first use
+    
+    Returns:
+        ProcessPoolExecutor using the spawn start method (CUDA can't survive a fork)
+    """
+    global _transcribe_pool
+    with _transcribe_pool_lock:
+        if _transcribe_pool is None:
+            _transcribe_pool = ProcessPoolExecutor(
+                max_workers=_VIDEO_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_preload_transcription_model
+            )
+        return _transcribe_pool
+
+def _decode_audio(video_path: str) -> Optional["np.ndarray"]:
+    """
+    Decode the audio track of a video straight to memory with ffmpeg
+    
+    Args:
+        video_path: Path to the video file
+        
+    Returns:
+        16 kHz mono float32 samples, or None if the video has no decodable audio
+    """
+    command = [
+        FFMPEG_BINARY, "-nostdin", "-v", "error", "-i", video_path,
+        "-vn", "-f", "s16le", "-ac", "1", "-ar", str(_SAMPLE_RATE), "-"
+    ]
+    try:
+        # Read raw PCM from the pipe instead of round-tripping through a WAV file
+        completed = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    except Exception as e:
+        print(f"Audio extraction error: {str(e)}")
+        return None
+        
+    if not completed.stdout:
+        return None
+    return np.frombuffer(completed.stdout, np.int16).astype(np.float32) / 32768.0
+
+def _transcribe_with_faster_whisper(model: Any, audio: "np.ndarray", batched: bool = False) -> Dict[str, Any]:
+    """
+    Transcribe audio with faster-whisper, returning the openai-whisper result layout
+    
+    Args:
+        model: faster-whisper WhisperModel
+        audio: 16 kHz mono float32 samples
+        batched: Encode the 30s windows in batches instead of one after another
+        
+    Returns:
+        Dict with text, segments and language
+    """
+    if batched:
+        # Segment timestamps come back relative to the whole clip
+        pipeline = BatchedInferencePipeline(model=model)
+        segments_iter, info = pipeline.transcribe(audio, beam_size=1, batch_size=_BATCH_SIZE)
+    else:
+        segments_iter, info = model.transcribe(audio, beam_size=1)
+    
+    # The segment iterator is lazy; decoding happens as it is consumed
+    segments = [
+        {
+            "id": segment.id,
+            "start": segment.start,
+            "end": segment.end,
+            "text": segment.text,
+            "confidence": math.exp(segment.avg_logprob)
+        }
+        for segment in segments_iter
+    ]
+    
+    return {
+        "text": "".join(segment["text"] for segment in segments).strip(),
+        "segments": segments,
+        "language": info.language
+    }
+
+def _audio_to_cuda(audio: "np.ndarray") -> "torch.Tensor":
+    """
+    Copy decoded samples to the GPU through pinned host memory
+    
+    Args:
+        audio: 16 kHz mono float32 samples
+        
+    Returns:
+        CUDA tensor holding the samples
+    """
+    # Page-locked memory lets the copy run as an async DMA on a side stream
+    host = torch.from_numpy(audio).pin_memory()
+    copy_stream = torch.cuda.Stream()
+    with torch.cuda.stream(copy_stream):
+        audio_gpu = host.to("cuda", non_blocking=True)
+    torch.cuda.current_stream().wait_stream(copy_stream)
+    audio_gpu.record_stream(torch.cuda.current_stream())
+    return audio_gpu
+
+def _transcribe_in_worker(video_path: str) -> Optional[Dict[str, Any]]:
+    """
+    Decode and transcribe a video inside a pool worker
+    
+    Args:
+        video_path: Path to the video file
+        
+    Returns:
+        Raw Whisper result, or None if no audio could be decoded
+    """
+    model, backend, device = _get_transcription_model()
+    
+    audio = _decode_audio(video_path)
+    if audio is None:
+        return None
+        
+    if backend == "faster-whisper":
+        # Long clips on a GPU are split into windows that share encoder batches
+        batched = (
+            BatchedInferencePipeline is not None
+            and device == "cuda"
+            and len(audio) > _WINDOW_SECONDS * _SAMPLE_RATE
+        )
+        return _transcribe_with_faster_whisper(model, audio, batched)
+    if device == "cuda":
+        # Whisper computes the mel spectrogram on whichever device the samples are on
+        audio = _audio_to_cuda(audio)
+    # FP16 only pays off (and is only supported) on CUDA
+    return model.transcribe(audio, fp16=device == "cuda")
 
 # Import the utility module for LangChain compatibility
 from .langchain_utils import (
     get_llm, 
     create_prompt, 
     run_llm_chain, 
+    json_loads,
+    parse_llm_json,
     LANGCHAIN_AVAILABLE
 )
 
@@ -37,9 +274,6 @@ class VideoProcessor(BaseProcessor):
         # Initialize the language model using our utility function
         self.llm = get_llm(model_name="gpt-4-turbo", temperature=0.2)
         
-        # Set up transcription engine (lazy initialization)
-        self._transcription_model = None
-        
         # Set up templates
         self.system_template = """You are a Video Transcriber & Analyzer, an AI trained to analyze video content and extract structured information.
         
@@ -60,47 +294,6 @@ Follow these guidelines:
 {instructions}
 """
         
-    @property
-    def transcription_model(self):
-        """Lazy initialization of transcription model"""
-        if self._transcription_model is None:
-            try:
-                self._transcription_model = whisper.load_model("base")
-            except Exception as e:
-                print(f"Warning: Failed to initialize Whisper model: {str(e)}")
-                self._transcription_model = None
-        return self._transcription_model
-        
-    async def _extract_audio(self, video_path: str) -> str:
-        """
-        Extract audio from a video file
-        
-        Args:
-            video_path: Path to the video file
-            
-        Returns:
-            Path to the extracted audio file
-        """
-        try:
-            # Create a temporary file for the audio
-            with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_audio:
-                temp_audio_path = temp_audio.name
-                
-            # Extract audio using moviepy
-            await asyncio.to_thread(
-                lambda: VideoFileClip(video_path).audio.write_audiofile(
-                    temp_audio_path, 
-                    codec='pcm_s16le', 
-                    verbose=False, 
-                    logger=None
-                )
-            )
-            
-            return temp_audio_path
-        except Exception as e:
-            print(f"Audio extraction error: {str(e)}")
-            return ""
-            
     async def _transcribe_video(self, video_path: str) -> Dict[str, Any]:
         """
         Extract audio and transcribe a video file using Whisper
@@ -111,34 +304,27 @@ Follow these guidelines:
         Returns:
             Dict with transcription results
         """
-        if not self.transcription_model:
+        if not (FASTER_WHISPER_AVAILABLE or WHISPER_AVAILABLE):
             return {"text": "Transcription model not available", "segments": []}
             
         try:
-            # Extract audio from video
-            audio_path = await self._extract_audio(video_path)
-            if not audio_path:
+            # Decode and transcribe in a worker process
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(_get_transcribe_pool(), _transcribe_in_worker, video_path)
+            if result is None:
                 return {"text": "Failed to extract audio from video", "segments": []}
-                
-            # Run transcription on the extracted audio
-            result = await asyncio.to_thread(self.transcription_model.transcribe, audio_path)
-            
-            # Clean up the temporary audio file
-            try:
-                os.unlink(audio_path)
-            except:
-                pass
             
             # Extract segments with timestamps
-            segments = []
-            for segment in result.get('segments', []):
-                segments.append({
+            segments = [
+                {
                     "id": segment.get('id', 0),
                     "start": segment.get('start', 0),
                     "end": segment.get('end', 0),
                     "text": segment.get('text', ''),
                     "confidence": segment.get('confidence', 0)
-                })
+                }
+                for segment in result.get('segments') or []
+            ]
                 
             return {
                 "text": result.get('text', ''),
@@ -150,6 +336,56 @@ Follow these guidelines:
             return {"text": f"Error: {str(e)}", "segments": []}
             
     async def _extract_video_metadata(self, video_path: str) -> Dict[str, Any]:
+        """
+        Extract metadata from a video file using ffprobe (moviepy if ffprobe is missing)
+        
+        Args:
+            video_path: Path to the video file
+            
+        Returns:
+            Dict with video metadata
+        """
+        if not FFPROBE_BINARY:
+            return await self._extract_video_metadata_moviepy(video_path)
+            
+        try:
+            # One ffprobe call reports every stream plus the container duration
+            proc = await asyncio.create_subprocess_exec(
+                FFPROBE_BINARY, "-v", "quiet", "-print_format", "json",
+                "-show_streams", "-show_format", video_path,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL
+            )
+            stdout, _ = await proc.communicate()
+            if proc.returncode != 0:
+                raise RuntimeError(f"ffprobe exited with code {proc.returncode}")
+            probe = json_loads(stdout)
+            
+            streams = probe.get("streams", [])
+            video = next((st for st in streams if st.get("codec_type") == "video"), {})
+            
+            # Rotation is a tag on older files and display-matrix side data on newer ones
+            rotation = video.get("tags", {}).get("rotate")
+            if rotation is None:
+                rotation = next(
+                    (sd["rotation"] for sd in video.get("side_data_list", []) if "rotation" in sd), 0
+                )
+            
+            frame_rate = video.get("avg_frame_rate") or video.get("r_frame_rate") or "0/1"
+            duration = probe.get("format", {}).get("duration") or video.get("duration")
+            
+            return {
+                "duration": float(duration) if duration else None,
+                "fps": float(Fraction(frame_rate)) if frame_rate != "0/0" else None,
+                "size": [video.get("width", 0), video.get("height", 0)],
+                "rotation": int(float(rotation)),
+                "has_audio": any(st.get("codec_type") == "audio" for st in streams)
+            }
+        except Exception as e:
+            print(f"Video metadata extraction error: {str(e)}")
+            return {}
+            
+    async def _extract_video_metadata_moviepy(self, video_path: str) -> Dict[str, Any]:
         """
         Extract metadata from a video file using moviepy
         
@@ -238,22 +474,9 @@ Follow these guidelines:
         # Extract structured data
         analysis = result_content
         
-        # Try to parse as JSON if it looks like JSON
-        structured_data = {}
-        try:
-            # Check if the result contains a JSON object
-            if "{" in analysis and "}" in analysis:
-                # Try to extract JSON from the text
-                json_start = analysis.find("{")
-                json_end = analysis.rfind("}") + 1
-                json_str = analysis[json_start:json_end]
-                
-                structured_data = json.loads(json_str)
-            else:
-                # If not JSON, keep as text
-                structured_data = {"analysis": analysis}
-        except json.JSONDecodeError:
-            # If JSON parsing fails, keep as text
+        # Try to parse as JSON, keeping the raw text if no JSON object is found
+        structured_data = parse_llm_json(analysis)
+        if structured_data is None:
             structured_data = {"analysis": analysis}
         
         # Combine transcription and analysis results
@@ -1,12 +1,67 @@
 """
-Script to process a single audio file for transcription.
+Script to process specific audio files for transcription.
 This targeted approach helps when only specific files need processing.
+Pass one or more file names; they are transcribed concurrently.
 """
 import asyncio
 import os
-import json
 import sys
-from openai import OpenAI
+import aiofiles
+import orjson
+import httpx
+import soundfile as sf
+from openai import AsyncOpenAI
+
+# One client per process so repeated calls reuse pooled keep-alive connections
+_OPENAI_CLIENT = None
+
+def get_client(api_key):
+    """Return the shared OpenAI client, creating it on first use."""
+    global _OPENAI_CLIENT
+    if _OPENAI_CLIENT is None:
+        limits = httpx.Limits(max_keepalive_connections=20)
+        try:
+            http_client = httpx.AsyncClient(http2=True, limits=limits, timeout=600.0)
+        except ImportError:
+            # h2 is not installed; fall back to HTTP/1.1 with the same pool
+            http_client = httpx.AsyncClient(limits=limits, timeout=600.0)
+        _OPENAI_CLIENT = AsyncOpenAI(api_key=api_key, http_client=http_client)
+    return _OPENAI_CLIENT
+
+async def transcribe_with_model(client, model, audio_filename, audio_data):
+    """Transcribe audio bytes with one model, returning (text, segments)."""
+    print(f"Attempting transcription with {model}...")
+    if model == "whisper-1":
+        # Whisper supports verbose JSON output; read the raw body and parse it
+        # with orjson rather than building the SDK's response models
+        async with client.audio.transcriptions.with_streaming_response.create(
+            model=model,
+            file=(audio_filename, audio_data), 
+            response_format="verbose_json"
+        ) as response:
+            data = orjson.loads(await response.read())
+        
+        # For whisper, we can get segments too
+        segments = [
+            {
+                "start": segment.get("start", 0),
+                "end": segment.get("end", 0),
+                "text": segment.get("text", "")
+            }
+            for segment in data.get("segments") or []
+        ]
+        
+        text = data.get("text", "")
+    else:
+        # GPT-4o models only support text format
+        async with client.audio.transcriptions.with_streaming_response.create(
+            model=model,
+            file=(audio_filename, audio_data), 
+            response_format="text"
+        ) as response:
+            text = await response.text()
+        segments = []
+    return text, segments
 
 async def process_single_audio_file(audio_filename):
     """Process a specific audio file with OpenAI API."""
@@ -16,11 +71,21 @@ async def process_single_audio_file(audio_filename):
     audio_path = os.path.join(audio_dir, audio_filename)
     output_path = os.path.join(processed_dir, f"{audio_filename}.json")
     
-    # Check if file exists
-    if not os.path.exists(audio_path):
+    # Check if file exists; one stat call also supplies the file metadata
+    try:
+        st = os.stat(audio_path)
+    except FileNotFoundError:
         print(f"Error: File not found: {audio_path}")
         return False
         
+    file_metadata = {
+        "file_name": audio_filename,
+        "file_extension": os.path.splitext(audio_filename)[1],
+        "file_size": st.st_size,
+        "last_modified": st.st_mtime,
+        "file_path": audio_path
+    }
+        
     # Create processed directory if it doesn't exist
     os.makedirs(processed_dir, exist_ok=True)
     
@@ -35,121 +100,102 @@ async def process_single_audio_file(audio_filename):
     masked_key = api_key[:8] + "..." + api_key[-4:]
     print(f"Using OpenAI API key: {masked_key}")
     
-    # Initialize OpenAI client
-    client = OpenAI(api_key=api_key)
+    # Get the shared OpenAI client
+    client = get_client(api_key)
     
     print(f"Processing {audio_filename}...")
     
     try:
-        # Try different models in sequence
-        models = ["gpt-4o-transcribe", "gpt-4o-mini-transcribe", "whisper-1"]
+        # Read the audio once without blocking the event loop
+        async with aiofiles.open(audio_path, "rb") as f:
+            audio_data = await f.read()
+        
+        # Race the GPT-4o models; whisper-1 stays a sequential fallback so it is
+        # only billed when neither of them succeeds
+        race_models = ["gpt-4o-transcribe", "gpt-4o-mini-transcribe"]
+        fallback_model = "whisper-1"
         result = None
         last_error = None
+        project_key_error = False
+        model = None
+        text = None
+        segments = []
         
-        for model in models:
-            try:
-                print(f"Attempting transcription with {model}...")
-                with open(audio_path, "rb") as file:
-                    if model == "whisper-1":
-                        # Whisper supports verbose JSON output
-                        response = client.audio.transcriptions.create(
-                            model=model,
-                            file=file, 
-                            response_format="verbose_json"
-                        )
-                        
-                        # For whisper, we can get segments too
-                        segments = []
-                        if hasattr(response, 'segments'):
-                            for segment in response.segments:
-                                segments.append({
-                                    "start": segment.get("start", 0),
-                                    "end": segment.get("end", 0),
-                                    "text": segment.get("text", "")
-                                })
-                        
-                        text = response.text if hasattr(response, 'text') else str(response)
-                        
-                    else:
-                        # GPT-4o models only support text format
-                        response = client.audio.transcriptions.create(
-                            model=model,
-                            file=file, 
-                            response_format="text"
-                        )
-                        text = response if isinstance(response, str) else str(response)
-                        segments = []
-                
-                # If we get here, transcription was successful
-                print(f"Successfully transcribed with {model}!")
-                if text:
-                    print(f"Text (first 100 chars): {text[:100]}...")
-                    
-                    # Format result to match API output structure
-                    file_metadata = {
-                        "file_name": audio_filename,
-                        "file_extension": os.path.splitext(audio_filename)[1],
-                        "file_size": os.path.getsize(audio_path),
-                        "last_modified": os.path.getmtime(audio_path),
-                        "file_path": audio_path
-                    }
-                    
-                    result = {
-                        "results": [
-                            {
-                                "output": {
-                                    "transcription": {
-                                        "text": text,
-                                        "segments": segments,
-                                        "metadata": {
-                                            "file_path": audio_path,
-                                            "status": "completed",
-                                            "model": model
-                                        }
-                                    },
-                                    "analysis": {
-                                        "description": "Audio transcribed successfully", 
-                                        "content_type": "audio",
-                                        "note": f"Transcribed using OpenAI {model}."
-                                    },
-                                    "metadata": file_metadata
-                                },
-                                "agent_type": "audio"
-                            }
-                        ]
-                    }
+        tasks = {
+            asyncio.create_task(transcribe_with_model(client, m, audio_filename, audio_data)): m
+            for m in race_models
+        }
+        pending = set(tasks)
+        while pending and not text:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                try:
+                    task_text, task_segments = task.result()
+                except Exception as e:
+                    last_error = str(e)
+                    print(f"Error with {tasks[task]}: {last_error}")
+                    if "project" in last_error.lower():
+                        project_key_error = True
+                    continue
+                if task_text and not text:
+                    model, text, segments = tasks[task], task_text, task_segments
                     
-                    # Break out of the loop since we succeeded
-                    break
+        # Cancel the slower model once one has succeeded
+        for task in pending:
+            task.cancel()
+            
+        if project_key_error and not text:
+            print("This appears to be due to using a project-scoped API key.")
+        elif not text:
+            try:
+                text, segments = await transcribe_with_model(client, fallback_model, audio_filename, audio_data)
+                model = fallback_model
             except Exception as e:
                 last_error = str(e)
-                print(f"Error with {model}: {last_error}")
+                print(f"Error with {fallback_model}: {last_error}")
                 
-                if "project-based" in last_error.lower() or "project" in last_error.lower():
-                    print("This appears to be due to using a project-scoped API key.")
-                    break
+        if text:
+            print(f"Successfully transcribed with {model}!")
+            print(f"Text (first 100 chars): {text[:100]}...")
+            
+            # Format result to match API output structure
+            result = {
+                "results": [
+                    {
+                        "output": {
+                            "transcription": {
+                                "text": text,
+                                "segments": segments,
+                                "metadata": {
+                                    "file_path": audio_path,
+                                    "status": "completed",
+                                    "model": model
+                                }
+                            },
+                            "analysis": {
+                                "description": "Audio transcribed successfully", 
+                                "content_type": "audio",
+                                "note": f"Transcribed using OpenAI {model}."
+                            },
+                            "metadata": file_metadata
+                        },
+                        "agent_type": "audio"
+                    }
+                ]
+            }
         
         # If we still don't have a result, create one with the error
         if not result:
             # Create a result with error info and basic audio metadata
-            import wave
-            
             try:
-                # Try to get audio info for WAV files
-                with wave.open(audio_path, 'rb') as wav_file:
-                    channels = wav_file.getnchannels()
-                    sample_width = wav_file.getsampwidth()
-                    framerate = wav_file.getframerate()
-                    frames = wav_file.getnframes()
-                    duration = frames / float(framerate)
-                    
-                    audio_info = {
-                        "channels": channels,
-                        "sample_width": sample_width, 
-                        "framerate": framerate,
-                        "duration": duration
-                    }
-            except:
+                # libsndfile reads only the header and handles WAV, FLAC, OGG and MP3
+                info = sf.info(audio_path)
+                audio_info = {
+                    "channels": info.channels,
+                    "framerate": info.samplerate,
+                    "duration": info.duration
+                }
+            except Exception:
                 audio_info = {"error": "Could not read audio file properties"}
             
             result = {
@@ -175,13 +221,7 @@ async def process_single_audio_file(audio_filename):
                                     "You can provide any details about the audio in a text note if needed."
                                 ]
                             },
-                            "metadata": {
-                                "file_name": audio_filename,
-                                "file_extension": os.path.splitext(audio_filename)[1],
-                                "file_size": os.path.getsize(audio_path),
-                                "last_modified": os.path.getmtime(audio_path),
-                                "file_path": audio_path
-                            }
+                            "metadata": file_metadata
                         },
                         "agent_type": "audio"
                     }
@@ -189,8 +229,8 @@ async def process_single_audio_file(audio_filename):
             }
             
         # Save the result
-        with open(output_path, "w") as f:
-            json.dump(result, f, indent=2)
+        with open(output_path, "wb") as f:
+            f.write(orjson.dumps(result, option=orjson.OPT_INDENT_2))
         print(f"Results saved to: {output_path}")
         return True
             
@@ -200,12 +240,13 @@ async def process_single_audio_file(audio_filename):
         traceback.print_exc()
         return False
 
+async def main(audio_filenames):
+    """Process several audio files concurrently on the shared client."""
+    return await asyncio.gather(*[process_single_audio_file(name) for name in audio_filenames])
+
 if __name__ == "__main__":
-    # Get the file name from command line argument or use default
-    if len(sys.argv) > 1:
-        audio_filename = sys.argv[1]
-    else:
-        audio_filename = "77d43df6-d368-43b2-a37a-08d182b5c657.wav"  # Default file to process
+    # Get the file names from command line arguments or use default
+    audio_filenames = sys.argv[1:] or ["77d43df6-d368-43b2-a37a-08d182b5c657.wav"]  # Default file to process
         
-    print(f"Will process audio file: {audio_filename}")
-    asyncio.run(process_single_audio_file(audio_filename))
+    print(f"Will process audio file(s): {', '.join(audio_filenames)}")
+    asyncio.run(main(audio_filenames))
@@ -0,0 +1,62 @@
+"""
+Script to export the PaddleOCR detection/recognition models to ONNX and
+quantize them to INT8 for faster CPU inference.
+
+Usage:
+    python quantize_ocr.py <det_model_dir> <rec_model_dir> [output_dir]
+
+The model directories are Paddle inference models (e.g. ch_PP-OCRv4_det_infer
+and en_PP-OCRv4_rec_infer). ImageProcessor runs OCR with lang='en', which
+decodes with en_dict.txt, so the recognition model must be an English one.
+Point IDP_OCR_ONNX_DIR at the output directory so ImageProcessor picks up
+det.quant.onnx / rec.quant.onnx.
+"""
+import os
+import sys
+import subprocess
+
+from onnxruntime.quantization import quantize_dynamic, QuantType
+
+def export_to_onnx(model_dir: str, output_path: str) -> None:
+    """Convert a Paddle inference model to ONNX with paddle2onnx."""
+    subprocess.run(
+        [
+            "paddle2onnx",
+            "--model_dir", model_dir,
+            "--model_filename", "inference.pdmodel",
+            "--params_filename", "inference.pdiparams",
+            "--save_file", output_path,
+            "--opset_version", "11",
+            "--enable_onnx_checker", "True",
+        ],
+        check=True,
+    )
+
+def quantize_model(model_path: str, output_path: str) -> None:
+    """Apply dynamic INT8 weight quantization to an ONNX model."""
+    # ONNX Runtime's ConvInteger kernel only supports unsigned 8-bit weights
+    quantize_dynamic(model_path, output_path, weight_type=QuantType.QUInt8)
+
+def main():
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(1)
+        
+    det_model_dir, rec_model_dir = sys.argv[1], sys.argv[2]
+    output_dir = sys.argv[3] if len(sys.argv) > 3 else os.path.join(os.path.dirname(__file__), "ocr_models")
+    os.makedirs(output_dir, exist_ok=True)
+    
+    for name, model_dir in (("det", det_model_dir), ("rec", rec_model_dir)):
+        onnx_path = os.path.join(output_dir, f"{name}.onnx")
+        quant_path = os.path.join(output_dir, f"{name}.quant.onnx")
+        
+        print(f"Exporting {model_dir} to {onnx_path}...")
+        export_to_onnx(model_dir, onnx_path)
+        
+        print(f"Quantizing {onnx_path} to {quant_path}...")
+        quantize_model(onnx_path, quant_path)
+        
+    print(f"Quantized OCR models saved to: {output_dir}")
+
+if __name__ == "__main__":
+    main()
@@ -2,14 +2,102 @@
 Script to reprocess audio files with the improved transcription code.
 Uses OpenAI API directly for more accurate transcription.
 """
+import argparse
 import asyncio
 import os
-import json
 import glob
-from openai import OpenAI
+import mimetypes
+import ssl
+import struct
+import httpx
+import orjson
+from openai import AsyncOpenAI
 
-async def reprocess_audio_files():
-    """Reprocess audio files in the uploads directory directly with OpenAI."""
+# mutagen reads headers of compressed formats (MP3, M4A, FLAC, OGG) without decoding
+try:
+    import mutagen
+except ImportError:
+    mutagen = None
+
+# Audio extensions picked up from the uploads directory (matched case-insensitively)
+AUDIO_EXTENSIONS = frozenset({'.wav', '.mp3', '.m4a', '.flac', '.ogg', '.aac'})
+
+# Max transcriptions in flight at once
+AUDIO_CONCURRENCY = int(os.environ.get("AUDIO_CONCURRENCY", "8"))
+
+# Build the TLS context and connection pool once; every request in the batch reuses them
+_SSL_CTX = ssl.create_default_context()
+
+def _make_http_client():
+    """Create the shared pool, multiplexing requests over HTTP/2 when h2 is installed."""
+    options = dict(
+        verify=_SSL_CTX,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=64),
+        timeout=httpx.Timeout(600.0, connect=10.0)
+    )
+    try:
+        return httpx.AsyncClient(http2=True, **options)
+    except ImportError:
+        return httpx.AsyncClient(**options)
+
+_HTTP = _make_http_client()
+
+def read_bytes(path):
+    """Read a whole file as bytes in one unbuffered read, with kernel readahead enabled."""
+    with open(path, "rb", buffering=0) as f:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        return f.read()
+
+def write_json(path, result):
+    """Serialize a result with two-space indentation and write it to disk."""
+    with open(path, "wb") as f:
+        f.write(orjson.dumps(result, option=orjson.OPT_INDENT_2))
+
+def wav_info(data):
+    """Parse channels, sample width, rate and duration from in-memory WAV bytes, or return None."""
+    if len(data) < 12 or data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        return None
+        
+    # Walk the RIFF chunks; 'fmt ' precedes 'data' but other chunks may sit between them
+    pos = 12
+    fmt = None
+    while pos + 8 <= len(data):
+        chunk_id, chunk_size = struct.unpack_from("<4sI", data, pos)
+        if chunk_id == b"fmt " and chunk_size >= 16:
+            _, channels, framerate, byte_rate, _, bits = struct.unpack_from("<HHIIHH", data, pos + 8)
+            fmt = (channels, framerate, byte_rate, bits)
+        elif chunk_id == b"data" and fmt and fmt[2]:
+            channels, framerate, byte_rate, bits = fmt
+            # Streamed WAVs may leave the size unset; clamp it to the bytes present
+            data_size = min(chunk_size, len(data) - pos - 8)
+            return {
+                "channels": channels,
+                "sample_width": bits // 8,
+                "framerate": framerate,
+                "duration": data_size / byte_rate
+            }
+        pos += 8 + chunk_size + (chunk_size & 1)
+    return None
+
+def audio_file_info(path, data):
+    """Read basic audio properties from the header of a WAV or compressed audio file."""
+    info = wav_info(data)
+    if info is None and mutagen is not None:
+        parsed = mutagen.File(path)
+        if parsed is not None and parsed.info is not None:
+            info = {
+                "channels": getattr(parsed.info, "channels", None),
+                "framerate": getattr(parsed.info, "sample_rate", None),
+                "duration": parsed.info.length
+            }
+    return info
+
+async def reprocess_audio_files(force=False):
+    """Reprocess audio files in the uploads directory directly with OpenAI.
+    
+    Files whose result JSON is newer than the audio are skipped unless force is set.
+    """
     audio_dir = "/workspaces/idp/backend/uploads/audio"
     processed_dir = "/workspaces/idp/backend/uploads/processed"
     
@@ -32,81 +120,120 @@ async def reprocess_audio_files():
     masked_key = api_key[:8] + "..." + api_key[-4:]
     print(f"Using OpenAI API key: {masked_key}")
     
+    # Models to try in sequence
+    models = ["gpt-4o-transcribe", "gpt-4o-mini-transcribe", "whisper-1"]
+    
     # Check if it's a project-based key
     if api_key.startswith("sk-proj-"):
         print("Warning: Using a project-scoped API key (sk-proj-). These keys have limitations.")
         print("Audio transcription might fail with project-scoped keys.")
+        # The GPT-4o transcription models reject these keys, so go straight to whisper-1
+        models = ["whisper-1"]
     
     # Initialize OpenAI client
-    client = OpenAI(api_key=api_key)
+    client = AsyncOpenAI(api_key=api_key, http_client=_HTTP)
     
-    # Get list of audio files (support more formats)
-    audio_files = []
-    for ext in ['.wav', '.mp3', '.m4a', '.flac', '.ogg', '.aac']:
-        audio_files.extend([f for f in os.listdir(audio_dir) if f.endswith(ext)])
+    # Get list of audio files in a single directory pass
+    with os.scandir(audio_dir) as it:
+        audio_entries = [
+            entry for entry in it
+            if entry.is_file() and os.path.splitext(entry.name)[1].lower() in AUDIO_EXTENSIONS
+        ]
     
-    print(f"Found {len(audio_files)} audio files to process")
+    print(f"Found {len(audio_entries)} audio files to process")
     
-    for audio_file in audio_files:
-        audio_path = os.path.join(audio_dir, audio_file)
+    semaphore = asyncio.Semaphore(AUDIO_CONCURRENCY)
+    
+    # Results are saved by a single writer task; the bound applies backpressure
+    write_queue = asyncio.Queue(maxsize=16)
+    
+    async def writer():
+        """Save queued results off the event loop, one at a time."""
+        while True:
+            output_path, result = await write_queue.get()
+            try:
+                await asyncio.to_thread(write_json, output_path, result)
+                print(f"Results saved to: {output_path}")
+            except Exception as e:
+                print(f"Error saving {output_path}: {str(e)}")
+            finally:
+                write_queue.task_done()
+    
+    async def process_one(entry):
+        """Transcribe one audio file and save its result."""
+        audio_file = entry.name
+        audio_path = entry.path
         output_path = os.path.join(processed_dir, f"{audio_file}.json")
+        mime_type = mimetypes.guess_type(audio_file)[0] or "application/octet-stream"
+        ext = os.path.splitext(audio_file)[1]
         
+        # Skip files whose saved result is already up to date
+        if not force:
+            try:
+                if os.stat(output_path).st_mtime >= entry.stat().st_mtime:
+                    print(f"Skipping {audio_file}: result is up to date")
+                    return
+            except FileNotFoundError:
+                pass
+                
         print(f"\n\nProcessing {audio_file}...")
         
         try:
+            # One stat call supplies the file metadata for both result shapes
+            st = entry.stat()
+            file_metadata = {
+                "file_name": audio_file,
+                "file_extension": ext,
+                "file_size": st.st_size,
+                "last_modified": st.st_mtime,
+                "file_path": audio_path
+            }
+            
+            # Read the file once, off the event loop, and reuse it for every model attempt
+            audio_data = await asyncio.to_thread(read_bytes, audio_path)
+            audio_upload = (audio_file, audio_data, mime_type)
+            
             # Try different models in sequence
-            models = ["gpt-4o-transcribe", "gpt-4o-mini-transcribe", "whisper-1"]
             result = None
             last_error = None
             
             for model in models:
                 try:
                     print(f"Attempting transcription with {model}...")
-                    with open(audio_path, "rb") as file:
-                        if model == "whisper-1":
-                            # Whisper supports verbose JSON output
-                            response = client.audio.transcriptions.create(
-                                model=model,
-                                file=file, 
-                                response_format="verbose_json"
-                            )
-                            
-                            # For whisper, we can get segments too
-                            segments = []
-                            if hasattr(response, 'segments'):
-                                for segment in response.segments:
-                                    segments.append({
-                                        "start": segment.get("start", 0),
-                                        "end": segment.get("end", 0),
-                                        "text": segment.get("text", "")
-                                    })
-                            
-                            text = response.text if hasattr(response, 'text') else str(response)
-                            
-                        else:
-                            # GPT-4o models only support text format
-                            response = client.audio.transcriptions.create(
-                                model=model,
-                                file=file, 
-                                response_format="text"
-                            )
-                            text = response if isinstance(response, str) else str(response)
-                            segments = []
-                    
+                    if model == "whisper-1":
+                        # Whisper supports verbose JSON output
+                        response = await client.audio.transcriptions.create(
+                            model=model,
+                            file=audio_upload, 
+                            response_format="verbose_json"
+                        )
+                        
+                        # For whisper, we can get segments too (dicts on older SDKs, objects on newer ones)
+                        segments = [
+                            {key: segment.get(key) for key in ("start", "end", "text")}
+                            if isinstance(segment, dict)
+                            else {"start": segment.start, "end": segment.end, "text": segment.text}
+                            for segment in getattr(response, 'segments', None) or []
+                        ]
+                        
+                        text = response.text
+                        
+                    else:
+                        # GPT-4o models only support text format
+                        response = await client.audio.transcriptions.create(
+                            model=model,
+                            file=audio_upload, 
+                            response_format="text"
+                        )
+                        text = response if isinstance(response, str) else str(response)
+                        segments = []
+                        
                     # If we get here, transcription was successful
                     print(f"Successfully transcribed with {model}!")
                     if text:
                         print(f"Text (first 100 chars): {text[:100]}...")
                         
                         # Format result to match API output structure
-                        file_metadata = {
-                            "file_name": audio_file,
-                            "file_extension": os.path.splitext(audio_file)[1],
-                            "file_size": os.path.getsize(audio_path),
-                            "last_modified": os.path.getmtime(audio_path),
-                            "file_path": audio_path
-                        }
-                        
                         result = {
                             "results": [
                                 {
@@ -145,24 +272,12 @@ async def reprocess_audio_files():
             # If we still don't have a result, create one with the error
             if not result:
                 # Create a result with error info and basic audio metadata
-                import wave
-                
                 try:
-                    # Try to get audio info for WAV files
-                    with wave.open(audio_path, 'rb') as wav_file:
-                        channels = wav_file.getnchannels()
-                        sample_width = wav_file.getsampwidth()
-                        framerate = wav_file.getframerate()
-                        frames = wav_file.getnframes()
-                        duration = frames / float(framerate)
-                        
-                        audio_info = {
-                            "channels": channels,
-                            "sample_width": sample_width, 
-                            "framerate": framerate,
-                            "duration": duration
-                        }
-                except:
+                    # Parse the header from the bytes already in memory (mutagen for non-WAV)
+                    audio_info = audio_file_info(audio_path, audio_data)
+                except Exception:
+                    audio_info = None
+                if not audio_info:
                     audio_info = {"error": "Could not read audio file properties"}
                 
                 result = {
@@ -188,28 +303,37 @@ async def reprocess_audio_files():
                                         "You can provide any details about the audio in a text note if needed."
                                     ]
                                 },
-                                "metadata": {
-                                    "file_name": audio_file,
-                                    "file_extension": os.path.splitext(audio_file)[1],
-                                    "file_size": os.path.getsize(audio_path),
-                                    "last_modified": os.path.getmtime(audio_path),
-                                    "file_path": audio_path
-                                }
+                                "metadata": file_metadata
                             },
                             "agent_type": "audio"
                         }
                     ]
                 }
                 
-            # Save the result
-            with open(output_path, "w") as f:
-                json.dump(result, f, indent=2)
-            print(f"Results saved to: {output_path}")
+            # Hand the result to the writer so the next request isn't held up by disk I/O
+            await write_queue.put((output_path, result))
                 
         except Exception as e:
             print(f"Error processing {audio_file}: {str(e)}")
             import traceback
             traceback.print_exc()
+            
+    async def process_with_limit(entry):
+        """Run process_one under the shared concurrency limit."""
+        async with semaphore:
+            await process_one(entry)
+            
+    # Transcribe files concurrently, bounded by the semaphore, on one pool for the whole batch
+    writer_task = asyncio.create_task(writer())
+    async with _HTTP:
+        await asyncio.gather(*(process_with_limit(entry) for entry in audio_entries), return_exceptions=True)
+        
+    # Wait for pending writes to finish before exiting
+    await write_queue.join()
+    writer_task.cancel()
 
 if __name__ == "__main__":
-    asyncio.run(reprocess_audio_files())
+    parser = argparse.ArgumentParser(description="Reprocess uploaded audio files with OpenAI transcription.")
+    parser.add_argument("--force", action="store_true", help="Reprocess files even if their result is up to date")
+    args = parser.parse_args()
+    asyncio.run(reprocess_audio_files(force=args.force))
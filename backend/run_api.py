@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 import uvicorn
 import os
+import importlib.util
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -29,12 +30,25 @@ def main():
     # Get the port from environment or default to 8000
     port = int(os.environ.get("PORT", 8000))
     
-    # Create any necessary directories
+    # Create any necessary directories, skipping those that already exist
     uploads_dir = Path(__file__).parent / "uploads"
-    uploads_dir.mkdir(exist_ok=True)
+    try:
+        with os.scandir(uploads_dir) as it:
+            existing = {entry.name for entry in it if entry.is_dir()}
+    except FileNotFoundError:
+        existing = set()
     
     for folder in ["text", "image", "video", "audio", "processed"]:
-        (uploads_dir / folder).mkdir(exist_ok=True)
+        if folder not in existing:
+            (uploads_dir / folder).mkdir(parents=True, exist_ok=True)
+    
+    # Auto-reload is for development only and can't be combined with multiple workers
+    reload_flag = os.environ.get("UVICORN_RELOAD", "0") == "1"
+    workers = None if reload_flag else int(os.environ.get("WEB_CONCURRENCY", "1"))
+    
+    # Use the C-accelerated event loop and HTTP parser when installed (uvicorn[standard])
+    loop = "uvloop" if importlib.util.find_spec("uvloop") else "auto"
+    http = "httptools" if importlib.util.find_spec("httptools") else "auto"
     
     # Start the uvicorn server
     print(f"Starting Document Intelligence API server at http://localhost:{port}")
@@ -42,8 +56,11 @@ def main():
         "demo_crew.api.main:app", 
         host="0.0.0.0", 
         port=port,
-        reload=True,  # Enable auto-reload during development
-        log_level="info"
+        reload=reload_flag,
+        workers=workers,
+        log_level=os.environ.get("LOG_LEVEL", "info"),
+        loop=loop,
+        http=http
     )
 
 if __name__ == "__main__":